@@ -1,3 +1,5 @@
+__version__ = '0.1'
+
 from .frontend import *
 from .emitter import *
 from .testbench import *
@@ -2,5 +2,7 @@ from . import model as M
 
 from .debug import *
 from .op import *
+from .parallel import *
+from .registry import *
 from .typespec import *
 from .utilities import *
\ No newline at end of file
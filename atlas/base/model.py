@@ -13,6 +13,19 @@ flip_map = {
     SignalDir.INOUT: SignalDir.INOUT,
 }
 
+#
+# Incremented whenever an existing signal or operator is renamed, re-parented
+# or (for signals) changes direction, but not when one is created. Caches of
+# generated names and directions (see VSymbolTable in the emitter) compare
+# against this to know when they are stale.
+#
+
+name_epoch = 0
+
+def BumpNameEpoch():
+    global name_epoch
+    name_epoch += 1
+
 @dataclass
 class SignalMeta(object):
     """Signal metadata record
@@ -34,6 +47,13 @@ class SignalMeta(object):
     def __hash__(self):
         return hash((self.name, self.parent, self.sigdir))
 
+    def __setattr__(self, key, value):
+        if (key in { 'name', 'parent', 'sigdir' }) and \
+            (key in self.__dict__) and \
+            (self.__dict__[key] is not value):
+            BumpNameEpoch()
+        object.__setattr__(self, key, value)
+
 @dataclass
 class ConnectionTree(object):
     """Connection tree node
@@ -162,6 +182,17 @@ class Module(object):
     instances : dict = field(default_factory=dict, compare=False, repr=False)
     signals : list = field(default_factory=list, compare=False, repr=False)
     ops : list = field(default_factory=list, compare=False, repr=False)
+    symbols : any = field(default=None, compare=False, repr=False)
+
+class CombStyle(object):
+    """How the emitter writes predicated combinational connections.
+
+    ASSIGN -- a chain of intermediate wires and ternary assigns
+    ALWAYS -- one always @* block with if / else per signal
+    """
+
+    ASSIGN = 0
+    ALWAYS = 1
 
 @dataclass
 class CircuitConfig(object):
@@ -169,6 +200,24 @@ class CircuitConfig(object):
 
     default_clock : bool = False
     default_reset : bool = False
+    comb_style : int = CombStyle.ASSIGN
+
+@dataclass
+class ModuleRegistry(object):
+    """Index of the modules elaborated in a circuit.
+
+    Fields:
+    modules -- dict mapping a module key (generator function + canonical args)
+        to module
+    names -- dict mapping a module name to its key
+    hits -- number of generator calls that reused an existing module
+    misses -- number of generator calls that had to elaborate a new module
+    """
+
+    modules : dict = field(default_factory=dict, repr=False)
+    names : dict = field(default_factory=dict, repr=False)
+    hits : int = 0
+    misses : int = 0
 
 @dataclass
 class Circuit(object):
@@ -180,3 +229,5 @@ class Circuit(object):
 
     top : Module = field(default=None, compare=False, repr=False)
     modules : list = field(default_factory=list, compare=False, repr=False)
+    registry : ModuleRegistry = \
+        field(default_factory=ModuleRegistry, compare=False, repr=False)
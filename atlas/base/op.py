@@ -24,6 +24,12 @@ class Operator(object):
             self.name = Operator.GetUniqueName(opname)
         self.signals = {}
 
+    def __setattr__(self, key, value):
+        if (key == 'name') and (key in self.__dict__) and \
+            (self.__dict__[key] is not value):
+            M.BumpNameEpoch()
+        object.__setattr__(self, key, value)
+
     def Declare(self):
         raise NotImplementedError()
 
@@ -0,0 +1,65 @@
+import multiprocessing
+import os
+
+__all__ = ['ForkMap']
+
+#
+# The function (and worker initializer) being mapped by ForkMap. Worker
+# processes are forked while these are set, so they inherit them along with
+# everything they reference instead of having them pickled.
+#
+
+fork_func = None
+fork_init = None
+
+def ForkInit():
+    if fork_init is not None:
+        fork_init()
+
+def ForkCall(item):
+    return fork_func(item)
+
+def ForkMap(func, items, jobs=None, initializer=None):
+    """Return [func(item) for item in items], computed by forked workers.
+
+    func -- any callable (e.g. a closure); it is not pickled
+    items -- the items to map (items and results must be picklable)
+    jobs -- number of worker processes (None for one per core)
+    initializer -- optional callable run once in each worker before func
+
+    N.B. Multiple jobs need the fork start method. Where it is not available,
+    or there is only one job or item, items are mapped sequentially in this
+    process (after calling initializer once).
+    """
+
+    global fork_func
+    global fork_init
+
+    items = list(items)
+
+    if jobs is None:
+        jobs = os.cpu_count()
+
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        jobs = 1
+
+    jobs = min(jobs, len(items))
+
+    if jobs <= 1:
+        if initializer is not None:
+            initializer()
+
+        return list(map(func, items))
+
+    fork_func = func
+    fork_init = initializer
+
+    try:
+        with multiprocessing.get_context('fork').Pool(
+            jobs, initializer=ForkInit) as pool:
+
+            return pool.map(ForkCall, items)
+
+    finally:
+        fork_func = None
+        fork_init = None
@@ -0,0 +1,155 @@
+from hashlib import sha256
+
+from . import model as M
+from .typespec import *
+
+__all__ = [
+    'CanonicalForm',
+    'ModuleKey',
+    'ModuleUid',
+    'RegistryLookup',
+    'RegistryInsert',
+    'RegistryName',
+]
+
+class IdentityKey(object):
+    """Key for an unhashable argument (e.g. a NumPy array): equal only to keys
+    of the very same object, which it keeps alive (as part of the registry
+    key) so its id() can't be reused.
+    """
+
+    def __init__(self, item):
+        self.item = item
+
+    def __eq__(self, other):
+        return (type(other) is IdentityKey) and (other.item is self.item)
+
+    def __hash__(self):
+        return id(self.item)
+
+    def __repr__(self):
+        return f'IdentityKey({type(self.item).__qualname__}, {id(self.item)})'
+
+def CanonicalForm(item):
+    """Produce a canonical, hashable form of a generator argument.
+
+    The canonical form is a nested tuple that is equal for two arguments if
+    and only if they describe the same thing structurally. Ints, strings and
+    typespecs are hashed by value (not by repr) and containers are walked
+    recursively. Dicts keep their insertion order, since ports and anything
+    else built by iterating them follow it.
+
+    N.B. bool is tagged separately from int so that Foo(True) and Foo(1) do not
+    alias.
+    """
+
+    t = type(item)
+
+    if (item is None) or (t in { bool, int, float, str, bytes }):
+        return (t.__name__, item)
+
+    elif t is tuple or t is list:
+        return (t.__name__, tuple(CanonicalForm(x) for x in item))
+
+    elif t is dict:
+        entries = [
+            (CanonicalForm(key), CanonicalForm(item[key])) for key in item
+        ]
+
+        return ('dict', tuple(entries))
+
+    elif t is Bits:
+        return ('Bits', item.width, item.signed, item.meta.sigdir)
+
+    elif t is List:
+        return (
+            'List',
+            item.length,
+            CanonicalForm(item.field_type),
+            item.meta.sigdir)
+
+    elif t is Bundle:
+        return ('Bundle', CanonicalForm(item.fields), item.meta.sigdir)
+
+    elif t is M.Module:
+
+        #
+        # Module names are unique within a circuit so they fully identify the
+        # module being passed in.
+        #
+
+        return ('Module', item.name)
+
+    #
+    # Anything else is keyed on its own equality if it is hashable and on its
+    # identity otherwise (a repr can elide contents, e.g. of large arrays, so
+    # it can't tell arguments apart reliably).
+    #
+
+    try:
+        hash(item)
+        return ('object', t.__qualname__, item)
+    except TypeError:
+        return ('identity', IdentityKey(item))
+
+def ModuleKey(func, args, kwargs):
+    """Produce the registry key of a module generator invocation.
+
+    The key holds the generator function itself (not its name), so distinct
+    closures or factory-made generators sharing a __qualname__ never alias.
+    """
+
+    return (func, CanonicalForm(args), CanonicalForm(kwargs))
+
+def ModuleUid(key):
+    """Produce a stable hex digest for a registry key."""
+
+    return sha256(repr(key[1:]).encode('utf-8')).hexdigest()
+
+def RegistryLookup(circuit : M.Circuit, key):
+    """Look up an already elaborated module in a circuit's registry.
+
+    Returns None (and counts a miss) if no module is registered under key.
+    """
+
+    registry = circuit.registry
+    m = registry.modules.get(key)
+
+    if m is None:
+        registry.misses += 1
+    else:
+        registry.hits += 1
+
+    return m
+
+def RegistryInsert(circuit : M.Circuit, key, module : M.Module):
+    """Register a newly elaborated module and append it to the circuit."""
+
+    registry = circuit.registry
+    assert key not in registry.modules
+    assert module.name not in registry.names, \
+        f'Duplicate module name: {module.name}'
+
+    registry.modules[key] = module
+    registry.names[module.name] = key
+    circuit.modules.append(module)
+
+def RegistryName(circuit : M.Circuit, base_name : str, key, has_args : bool):
+    """Pick a module name for key that is unique within the circuit.
+
+    Generators called without arguments keep their plain name. Otherwise the
+    name is the generator name plus the shortest prefix (at least four hex
+    digits) of the key's digest that does not collide with another module.
+    """
+
+    if (not has_args) and (base_name not in circuit.registry.names):
+        return base_name
+
+    uid = ModuleUid(key)
+
+    for length in range(4, len(uid) + 1):
+        name = f'{base_name}_{uid[0:length]}'
+        if name not in circuit.registry.names:
+            return name
+
+    assert False, f'Could not produce a unique name for {base_name}'
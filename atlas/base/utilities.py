@@ -68,6 +68,26 @@ def ForBitsInModule(module):
         for bits in ForEachBits(signal):
             yield bits
 
+def RegisterIndex(module):
+    """Group the registers of a module by clock and reset in a single pass.
+
+    Returns a dict mapping each clock signal to a dict mapping each reset signal
+    (or None for registers without a reset) to the list of registers clocked
+    and reset by them. All dicts preserve the order of first appearance in the
+    module's signal list.
+    """
+
+    index = {}
+
+    for bits in ForBitsInModule(module):
+        if bits.clock is None:
+            continue
+
+        resets = index.setdefault(bits.clock, {})
+        resets.setdefault(bits.reset, []).append(bits)
+
+    return index
+
 def ForEachIoBits(io_dict : dict):
     for key in io_dict:
         for bits in ForEachBits(io_dict[key]):
@@ -127,76 +147,58 @@ def InsertConnection(lhs, predicate, rhs):
 
     block.append(rhs)
 
-def BuildConnectionTree(connections, debug_name=None):
+def BuildConnectionTree(connections, debug_name=None, base=None):
     """Build a binary tree of connections based off a connection AST.
 
     connections -- list of connections to convert
+    base -- tree for whatever was assigned before these connections (if any)
+
+    The connection list is walked once, front to back, keeping the tree for
+    "everything assigned so far". An unpredicated connection replaces it and a
+    ConnectionBlock wraps it in a new node whose paths are built on top of it.
+    A path with no connections simply reuses the tree that came before it, so
+    the result is a DAG in which earlier assignments are shared rather than
+    copied.
+
+    Worst case: each item of the AST is visited exactly once and each
+    ConnectionBlock produces exactly one node, so both time and the number of
+    nodes are O(number of items in the AST). Recursion depth is the nesting
+    depth of the AST.
     """
 
-    if len(connections) == 0:
-        return None
+    ctree = base
+
+    for item in connections:
+        if type(item) is not M.ConnectionBlock:
+            ctree = item
+            continue
+
+        assert (len(item.true_block) > 0) or (len(item.false_block) > 0)
 
-    #
-    # If the last assignment was un-predicated, all preceding assignments are
-    # ignored by order of precedence, so just return it by itself.
-    #
+        if len(item.true_block) > 0:
+            true_path = BuildConnectionTree(item.true_block, debug_name, ctree)
+        else:
+            true_path = ctree
 
-    if type(connections[-1]) is not M.ConnectionBlock:
-        return connections[-1]
+        if len(item.false_block) > 0:
+            false_path = BuildConnectionTree(item.false_block, debug_name, ctree)
+        else:
+            false_path = ctree
 
-    #
-    # If there is a single connection in the list and it _is_ a connection
-    # block, then it should have connections in both true and false paths, or
-    # the assignment tree is incomplete (which will result in compilable code).
-    #
+        #
+        # If either path ends up with nothing assigned to it, the signal is not
+        # driven under some combination of predicates.
+        #
 
-    if len(connections) == 1:
-        assert (len(connections[-1].true_block) > 0) and \
-            (len(connections[-1].false_block) > 0), \
+        assert (true_path is not None) and (false_path is not None), \
             f'Signal {debug_name} has incomplete connection ast'
 
-    #
-    # If the last assignment is predicated with both paths containing non-zero
-    # number of assignments, it's possible that one of the nodes deeper in the
-    # tree hasn't fully filled out it's true / false paths. In order to ensure
-    # correct behavior, the preceding connections in the current context are
-    # promoted one level deeper (connections[:-1] + <true/false>_block).
-    #
-
-    if (len(connections[-1].true_block) > 0) and \
-        (len(connections[-1].false_block) > 0):
-
-        return M.ConnectionTree(
-            predicate=connections[-1].predicate,
-            true_path=BuildConnectionTree(
-                connections[:-1] + connections[-1].true_block, debug_name),
-
-            false_path=BuildConnectionTree(
-                connections[:-1] + connections[-1].false_block, debug_name))
-
-    #
-    # If the last assignment was predicated but one of the two paths has no
-    # assignments, then defer to previous connections in this block.
-    #
-
-    assert not ((len(connections[-1].true_block) == 0) and \
-        (len(connections[-1].false_block) == 0))
-
-    sub_ctree = BuildConnectionTree(connections[:-1], debug_name)
-
-    if len(connections[-1].true_block) > 0:
-        return M.ConnectionTree(
-            predicate=connections[-1].predicate,
-            true_path=BuildConnectionTree(
-                connections[:-1] + connections[-1].true_block, debug_name),
-            false_path=sub_ctree)
-
-    if len(connections[-1].false_block) > 0:
-        return M.ConnectionTree(
-            predicate=connections[-1].predicate,
-            true_path=sub_ctree,
-            false_path=BuildConnectionTree(
-                connections[:-1] + connections[-1].false_block, debug_name))
+        ctree = M.ConnectionTree(
+            predicate=item.predicate,
+            true_path=true_path,
+            false_path=false_path)
+
+    return ctree
 
 def PrintCTree(ctree, indent=0):
     def WriteLine(line):
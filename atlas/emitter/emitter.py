@@ -1,3 +1,8 @@
+from hashlib import sha256
+import io
+import json
+import os
+
 from ..base import *
 
 from .verilog import *
@@ -12,37 +17,50 @@ def NewNodeName():
     return f'_NODE_{this_id}'
 
 def EmitCombNode(target, node):
-    if type(node.true_path) is not M.ConnectionTree:
-        true_node = node.true_path
-    else:
-        true_node = M.BitsSignal(
-            M.SignalMeta(
-                name=NewNodeName(),
-                parent=None,
-            ),
-            width=target.width
-        )
-
-        VDeclWire(true_node)
-        EmitCombNode(true_node, node.true_path)
-
-    if type(node.false_path) is not M.ConnectionTree:
-        false_node = node.false_path
-    else:
-        false_node = M.BitsSignal(
-            M.SignalMeta(
-                name=NewNodeName(),
-                parent=None,
-            ),
-            width=target.width
-        )
+    """Emit the connection tree rooted at node as assignments to target.
+
+    Connection trees are DAGs: a subtree shared by several parents is only
+    emitted once and its wire is reused. The tree is walked with an explicit
+    stack since long chains of sequential conditions produce very deep trees.
+    """
+
+    node_map = {}
+
+    def PathName(path):
+        if type(path) is M.ConnectionTree:
+            return VName(node_map[id(path)])
+        else:
+            return VName(path)
+
+    stack = [('assign', target, node)]
 
-        VDeclWire(false_node)
-        EmitCombNode(false_node, node.false_path)
+    while len(stack) > 0:
+        (action, target, node) = stack.pop()
 
-    VAssignRaw(
-        VName(target),
-        f'{VName(node.predicate)} ? {VName(true_node)} : {VName(false_node)}')
+        if action == 'assign':
+            stack.append(('emit', target, node))
+            stack.append(('path', target, node.false_path))
+            stack.append(('path', target, node.true_path))
+
+        elif action == 'path':
+            if (type(node) is M.ConnectionTree) and (id(node) not in node_map):
+                node_bits = M.BitsSignal(
+                    M.SignalMeta(
+                        name=NewNodeName(),
+                        parent=None,
+                    ),
+                    width=target.width
+                )
+
+                VDeclWire(node_bits)
+                node_map[id(node)] = node_bits
+                stack.append(('assign', node_bits, node))
+
+        else:
+            VAssignRaw(
+                VName(target),
+                f'{VName(node.predicate)} ? {PathName(node.true_path)} : ' +
+                f'{PathName(node.false_path)}')
 
 def EmitComb(bits):
     assert bits.clock is None
@@ -53,7 +71,34 @@ def EmitComb(bits):
     else:
         VAssignRaw(VName(bits), VName(ctree))
 
-def EmitSeqConnections(bits, connections=None):
+def IsPredicated(bits):
+    """Whether bits' final value depends on a predicate."""
+    return (len(bits.connections) > 0) and \
+        (type(bits.connections[-1]) is M.ConnectionBlock)
+
+def EmitCombAlways(bits):
+    assert bits.clock is None
+
+    #
+    # Still build the tree to check that every path assigns the signal (which
+    # would otherwise infer a latch).
+    #
+
+    BuildConnectionTree(bits.connections, VName(bits))
+
+    #
+    # Anything before the last unpredicated connection is overridden by it.
+    #
+
+    first = 0
+    for i in range(len(bits.connections)):
+        if type(bits.connections[i]) is not M.ConnectionBlock:
+            first = i
+
+    with VAlways():
+        EmitSeqConnections(bits, bits.connections[first:], nonblock=False)
+
+def EmitSeqConnections(bits, connections=None, nonblock=True):
     if connections is None:
         connections = bits.connections
 
@@ -62,52 +107,86 @@ def EmitSeqConnections(bits, connections=None):
 
             if len(item.true_block) > 0:
                 with VIf(item.predicate):
-                    EmitSeqConnections(bits, item.true_block)
+                    EmitSeqConnections(bits, item.true_block, nonblock)
 
             if len(item.false_block) > 0:
                 if len(item.true_block) == 0:
                     with VIf(item.predicate, invert=True):
-                        EmitSeqConnections(bits, item.false_block)
+                        EmitSeqConnections(bits, item.false_block, nonblock)
                 else:
                     with VElse():
-                        EmitSeqConnections(bits, item.false_block)
+                        EmitSeqConnections(bits, item.false_block, nonblock)
         else:
-            VConnect(bits, item)
+            VConnect(bits, item, nonblock)
 
-def EmitSeq(module):
-    clocks = set()
+def EmitSeq(module, index=None):
+    """Emit the sequential logic of a module.
 
-    for bits in filter(lambda bits: bits.clock is not None, ForBitsInModule(module)):
-        if bits.clock is not None:
-            clocks.add(bits.clock)
+    index -- optional RegisterIndex(module) if the caller already has one
+    """
 
-    for clock in clocks:
-        resets = set()
+    if index is None:
+        index = RegisterIndex(module)
 
-        for bits in filter(lambda bits: bits.clock is clock, ForBitsInModule(module)):
-            if bits.reset is not None:
-                resets.add(bits.reset)
+    for clock in index:
+        resets = index[clock]
 
         with VAlways([VPosedge(clock)]):
             for reset in resets:
+                if reset is None:
+                    continue
+
                 with VIf(reset):
-                    for bits in filter(lambda bits: bits.clock is clock and bits.reset is reset, ForBitsInModule(module)):
+                    for bits in resets[reset]:
                         VConnect(bits, bits.reset_value)
                 with VElse():
-                    for bits in filter(lambda bits: bits.clock is clock and bits.reset is reset, ForBitsInModule(module)):
+                    for bits in resets[reset]:
                         EmitSeqConnections(bits)
 
-            for bits in filter(lambda bits: bits.clock is clock and bits.reset is None, ForBitsInModule(module)):
+            for bits in resets.get(None, []):
                 EmitSeqConnections(bits)
 
-def EmitModule(module):
-    signals = []
+def EmitModule(module, comb_style=M.CombStyle.ASSIGN):
+    global nodeid
+
+    #
+    # Node names only need to be unique within a module. Restarting them per
+    # module makes a module's text independent of what was emitted before it.
+    #
+
+    nodeid = 0
 
-    with VModule(module.name, module.io_dict):
+    with VSymbols(ModuleSymbols(module)):
+        EmitModuleBody(module, comb_style)
+
+def EmitModuleBody(module, comb_style):
+
+    #
+    # Find combinational signals that will be driven from an always block.
+    # These need to be declared as reg rather than wire. Inout ports can't be
+    # regs, so they keep using continuous assignments.
+    #
+
+    comb_bits = [
+        bits for bits in ForEachIoBits(module.io_dict)
+        if VDirection(bits) != M.SignalDir.INPUT
+    ] + [
+        bits for bits in ForBitsInModule(module)
+        if bits.clock is None
+    ]
+
+    always_bits = set()
+
+    if comb_style == M.CombStyle.ALWAYS:
+        always_bits = set(
+            id(bits) for bits in comb_bits
+            if IsPredicated(bits) and (VDirection(bits) != M.SignalDir.INOUT))
+
+    with VModule(module.name, module.io_dict, always_bits):
         VEmitRaw('// Internal Signal Declarations')
         for signal in module.signals:
             for bits in ForEachBits(signal):
-                if bits.clock is None:
+                if (bits.clock is None) and (id(bits) not in always_bits):
                     VDeclWire(bits)
                 else:
                     VDeclReg(bits)
@@ -124,20 +203,19 @@ def EmitModule(module):
         VEmitRaw('')
 
         VEmitRaw(f'// Connections')
-        for bits in ForEachIoBits(module.io_dict):
-            sigdir = GetDirection(bits)
-            if sigdir != M.SignalDir.INPUT:
-                if len(bits.connections) > 0:
-                    EmitComb(bits)
 
         #
         # Emit Combinational Connections
         #
 
-        for signal in module.signals:
-            for bits in ForEachBits(signal):
-                if (len(bits.connections) > 0) and (bits.clock is None):
-                    EmitComb(bits)
+        for bits in comb_bits:
+            if len(bits.connections) == 0:
+                continue
+
+            if id(bits) in always_bits:
+                EmitCombAlways(bits)
+            else:
+                EmitComb(bits)
 
         #
         # Emit Sequential Connections
@@ -145,7 +223,107 @@ def EmitModule(module):
 
         EmitSeq(module)
 
-def EmitCircuit(circuit, filename='a.v'):
-    with VFile(filename):
+def EmitCircuitTo(circuit, writer):
+    """Emit every module in circuit to a VWriter.
+
+    Returns the writer's per-module VEmitStats.
+    """
+
+    with VOutput(writer):
         for module in circuit.modules:
-            EmitModule(module)
\ No newline at end of file
+            EmitModule(module, circuit.config.comb_style)
+
+    return writer.module_stats
+
+def EmitCircuit(circuit, filename='a.v', incremental=False):
+    """Emit circuit to filename (gzip compressed if it ends in .gz).
+
+    If incremental is set, filename is left untouched when its content would
+    not change. Returns per-module VEmitStats.
+    """
+
+    with VFile(filename, incremental) as writer:
+        return EmitCircuitTo(circuit, writer)
+
+def ModuleFilename(dirname, module):
+    return os.path.join(dirname, f'{module.name}.v')
+
+def FilelistName(dirname, circuit):
+    return os.path.join(dirname, f'{circuit.name}.f')
+
+def ManifestName(dirname, circuit):
+    return os.path.join(dirname, f'{circuit.name}.manifest.json')
+
+def LoadManifest(filename):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def EmitModuleFile(circuit, dirname, old_manifest, index):
+    module = circuit.modules[index]
+    filename = ModuleFilename(dirname, module)
+    writer = VWriter(io.StringIO())
+
+    with VOutput(writer):
+        EmitModule(module, circuit.config.comb_style)
+
+    text = writer.stream.getvalue()
+    digest = sha256(text.encode('utf-8')).hexdigest()
+    stats = writer.module_stats[module.name]
+
+    stats.rewritten = (old_manifest.get(module.name) != digest) or \
+        (not os.path.exists(filename))
+
+    if stats.rewritten:
+        with open(filename, 'w') as f:
+            f.write(text)
+
+    return (module.name, stats, digest)
+
+def EmitCircuitFiles(circuit, dirname, jobs=1, incremental=True):
+    """Emit each module of circuit into its own file in dirname.
+
+    jobs -- number of worker processes (None for one per core)
+    incremental -- only rewrite module files whose content changed
+
+    Module M is written to <dirname>/M.v and a Verilator file list (for -f) of
+    all of them is written to <dirname>/<circuit name>.f. The sha256 of each
+    module's text is recorded in <dirname>/<circuit name>.manifest.json, and on
+    the next run files whose hash is unchanged are not touched so their mtimes
+    (and anything downstream that depends on them) stay put. Module files from
+    the previous manifest that are no longer part of the circuit are removed.
+
+    Returns per-module VEmitStats. Modules are emitted in worker processes
+    through ForkMap.
+    """
+
+    os.makedirs(dirname, exist_ok=True)
+
+    manifest_name = ManifestName(dirname, circuit)
+    old_manifest = LoadManifest(manifest_name)
+    compare_manifest = old_manifest if incremental else {}
+
+    results = ForkMap(
+        lambda index: EmitModuleFile(circuit, dirname, compare_manifest, index),
+        range(len(circuit.modules)),
+        jobs)
+
+    manifest = { name: digest for (name, _, digest) in results }
+
+    for name in old_manifest:
+        if name not in manifest:
+            try:
+                os.remove(os.path.join(dirname, f'{name}.v'))
+            except OSError:
+                pass
+
+    filelist = ''.join([
+        ModuleFilename(dirname, module) + '\n' for module in circuit.modules
+    ])
+
+    WriteIfChanged(FilelistName(dirname, circuit), filelist)
+    WriteIfChanged(manifest_name, json.dumps(manifest, indent=4) + '\n')
+
+    return { name: stats for (name, stats, _) in results }
@@ -1,11 +1,23 @@
 from contextlib import contextmanager
+import gzip
+import io
+
 from ..base import *
 
 __all__ = [
+    'VEmitStats',
+    'VWriter',
+    'VOutput',
     'VFile',
+    'WriteIfChanged',
     'VEmitRaw',
     'VPosedge',
     'VName',
+    'VDirection',
+    'VSymbolTable',
+    'BuildSymbolTable',
+    'ModuleSymbols',
+    'VSymbols',
     'VModule',
     'VModuleInstance',
     'VDeclReg',
@@ -19,32 +31,143 @@ __all__ = [
     'VElse'
 ]
 
-current_file = None
-indent = 0
+@dataclass
+class VEmitStats(object):
+    """Amount of Verilog emitted (e.g. for one module).
+
+    rewritten is False if incremental emission found the output unchanged and
+    left the file on disk untouched.
+    """
+
+    lines : int = 0
+    bytes : int = 0
+    rewritten : bool = True
+
+class VWriter(object):
+    """Buffered sink for generated Verilog.
+
+    Lines are accumulated in memory and written to the underlying text stream
+    in chunks of roughly chunk_size characters. The stream can be anything with
+    a write() method: a file, an io.StringIO, a gzip text stream, etc...
+
+    Fields:
+    lines / bytes -- total amount of text emitted so far
+    module_stats -- dict mapping module name to its VEmitStats
+    """
+
+    def __init__(self, stream, chunk_size=1 << 20):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.chunk = []
+        self.chunk_len = 0
+        self.indent = 0
+        self.prefix = ''
+        self.lines = 0
+        self.bytes = 0
+        self.module_stats = {}
+
+    def Indent(self):
+        self.indent += 1
+        self.prefix = '    ' * self.indent
+
+    def Dedent(self):
+        assert self.indent > 0
+        self.indent -= 1
+        self.prefix = '    ' * self.indent
+
+    def Write(self, line):
+        text = self.prefix + line + '\n'
+        self.chunk.append(text)
+        self.chunk_len += len(text)
+        self.lines += 1
+
+        if self.chunk_len >= self.chunk_size:
+            self.Flush()
+
+    def Flush(self):
+        if len(self.chunk) > 0:
+            self.stream.write(''.join(self.chunk))
+
+        self.bytes += self.chunk_len
+        self.chunk = []
+        self.chunk_len = 0
+
+    def Tell(self):
+        """Return VEmitStats for everything written so far."""
+        return VEmitStats(self.lines, self.bytes + self.chunk_len)
+
+current_writer = None
 
 @contextmanager
-def VFile(filename):
-    global current_file
-    with open(filename, 'w') as f:
-        current_file = f
-        yield
-        current_file = None
+def VOutput(writer : VWriter):
+    """Direct all emitted Verilog to writer for the duration of the context."""
+
+    global current_writer
+    prev_writer = current_writer
+    current_writer = writer
+
+    yield writer
+
+    writer.Flush()
+    current_writer = prev_writer
+
+def OpenVFile(filename, mode):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode + 't')
+    else:
+        return open(filename, mode)
+
+def WriteIfChanged(filename, text):
+    """Write text to filename unless it already contains exactly that.
+
+    Returns whether the file was written.
+    """
+
+    try:
+        with OpenVFile(filename, 'r') as f:
+            if f.read() == text:
+                return False
+    except OSError:
+        pass
+
+    with OpenVFile(filename, 'w') as f:
+        f.write(text)
+
+    return True
+
+@contextmanager
+def VFile(filename, incremental=False):
+    """Emit Verilog to filename (gzip compressed if it ends in .gz).
+
+    If incremental is set, output is collected in memory and the file is only
+    rewritten (bumping its mtime) if the content changed.
+    """
+
+    if incremental:
+        writer = VWriter(io.StringIO())
+
+        with VOutput(writer):
+            yield writer
+
+        rewritten = WriteIfChanged(filename, writer.stream.getvalue())
+
+        for name in writer.module_stats:
+            writer.module_stats[name].rewritten = rewritten
+
+    else:
+        with OpenVFile(filename, 'w') as f:
+            with VOutput(VWriter(f)) as writer:
+                yield writer
 
 def Indent():
-    global indent
-    indent += 1
+    current_writer.Indent()
 
 def Dedent():
-    global indent
-    assert indent > 0
-    indent -= 1
+    current_writer.Dedent()
 
 def VEmitRaw(line):
-    global indent
-    global current_file
-    assert current_file is not None
-    current_file.write('    ' * indent + line + '\n')
-    # f.write(f'{line}\n')
+    assert current_writer is not None
+    current_writer.Write(line)
 
 @dataclass
 class VPosedge(object):
@@ -103,6 +226,7 @@ def VNameSignal(signal):
     return '_'.join(reversed(name_parts))
 
 name_func_map = {
+    bool: VNameBool,
     int: VNameInt,
     str: VNameStr,
     VPosedge: VNameEdge,
@@ -111,22 +235,133 @@ name_func_map = {
     M.BundleSignal: VNameSignal
 }
 
+class VSymbolTable(object):
+    """Cache of the Verilog names and directions of a module's signals.
+
+    Naming a signal walks its parent chain and resolving its direction walks it
+    again, and the same signal is named many times while emitting a module.
+    A symbol table does each once per signal. It is filled in up front for the
+    module's IO and signals and lazily for anything else (e.g. operator
+    results) that gets named while it is active.
+
+    The table is only valid as long as no signal or operator is renamed,
+    re-parented or flipped (see M.name_epoch); ModuleSymbols() rebuilds stale
+    tables.
+    """
+
+    def __init__(self):
+        self.epoch = M.name_epoch
+        self.names = {}
+        self.dirs = {}
+
+    def Valid(self):
+        return self.epoch == M.name_epoch
+
+    def Name(self, bits):
+
+        #
+        # Parentless signals (e.g. the emitter's temporary nodes) are named
+        # directly and not kept around.
+        #
+
+        if bits.meta.parent is None:
+            return VNameSignal(bits)
+
+        entry = self.names.get(id(bits))
+
+        if entry is None:
+            entry = (bits, VNameSignal(bits))
+            self.names[id(bits)] = entry
+
+        return entry[1]
+
+    def Direction(self, bits):
+        entry = self.dirs.get(id(bits))
+
+        if entry is None:
+            entry = (bits, GetDirection(bits))
+            self.dirs[id(bits)] = entry
+
+        return entry[1]
+
+def BuildSymbolTable(module):
+    """Produce a VSymbolTable for a fully elaborated (and named) module."""
+
+    table = VSymbolTable()
+
+    for bits in ForEachIoBits(module.io_dict):
+        table.Name(bits)
+        table.Direction(bits)
+
+    for bits in ForBitsInModule(module):
+        table.Name(bits)
+
+    return table
+
+def ModuleSymbols(module):
+    """Return the (cached) symbol table of a module."""
+
+    if (module.symbols is None) or (not module.symbols.Valid()):
+        module.symbols = BuildSymbolTable(module)
+
+    return module.symbols
+
+current_symbols = None
+
+@contextmanager
+def VSymbols(table : VSymbolTable):
+    """Resolve names and directions through table for the duration."""
+
+    global current_symbols
+    prev_symbols = current_symbols
+    current_symbols = table
+
+    yield table
+
+    current_symbols = prev_symbols
+
 def VName(item):
+    if (type(item) is M.BitsSignal) and (current_symbols is not None):
+        return current_symbols.Name(item)
+
+    name_func = name_func_map.get(type(item))
+    if name_func is not None:
+        return name_func(item)
+
     for key in name_func_map:
         if isinstance(item, key):
             return name_func_map[key](item)
 
     assert False, f'Cannot name item of type: {type(item)}'
 
+def VDirection(bits):
+    if current_symbols is not None:
+        return current_symbols.Direction(bits)
+
+    return GetDirection(bits)
+
 @contextmanager
-def VModule(name : str, io_dict : dict):
+def VModule(name : str, io_dict : dict, reg_bits=None):
+    """Emit a module.
+
+    reg_bits -- optional set of id()s of output bits to be declared as reg
+    """
+
+    start = current_writer.Tell()
+
     VEmitRaw(f'module {name} (')
     Indent()
 
     io_lines = []
 
     for bits in ForEachIoBits(io_dict):
-        dirstr = dirstr_map[GetDirection(bits)]
+        dirstr = dirstr_map[VDirection(bits)]
+
+        if (reg_bits is not None) and (id(bits) in reg_bits):
+            assert VDirection(bits) == M.SignalDir.OUTPUT, \
+                f'Only output ports can be declared as reg: {VName(bits)}'
+            dirstr += ' reg'
+
         if bits.width == 1:
             io_lines.append(f'{dirstr} {VName(bits)}')
         else:
@@ -148,6 +383,10 @@ def VModule(name : str, io_dict : dict):
 
     VEmitRaw('endmodule')
 
+    end = current_writer.Tell()
+    current_writer.module_stats[name] = \
+        VEmitStats(end.lines - start.lines, end.bytes - start.bytes)
+
 @contextmanager
 def VModuleInstance(module_name, instance_name):
     VEmitRaw(f'{module_name} {instance_name} (')
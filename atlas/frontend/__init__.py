@@ -1,3 +1,4 @@
+from .cache import *
 from .context import *
 from .frontend import *
 from .signals import *
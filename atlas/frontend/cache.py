@@ -0,0 +1,314 @@
+import glob
+import inspect
+import io
+import marshal
+import os
+import pickle
+import zlib
+from hashlib import sha256
+
+from ..base import *
+
+__all__ = ['ElaborationCache']
+
+class _Uncacheable(Exception):
+    pass
+
+def _RestoreState(obj, state):
+    obj.__dict__.update(state)
+
+class _ModulePickler(pickle.Pickler):
+    """Pickler for a single M.Module.
+
+    Any other module reachable from the root (i.e. through an InstanceOperator)
+    is stored by name and re-attached to the circuit's copy on load.
+    """
+
+    def __init__(self, file, root):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.root = root
+
+    def persistent_id(self, obj):
+        if (type(obj) is M.Module) and (obj is not self.root):
+            return ('module', obj.name)
+        return None
+
+    def reducer_override(self, obj):
+
+        #
+        # Frontend wrappers and InstanceOperator forward unknown attributes via
+        # __getattr__, which recurses forever if pickle probes a half-built
+        # instance for __setstate__. Rebuild those from their __dict__ instead.
+        #
+
+        t = type(obj)
+        if (t is not type) and hasattr(t, '__getattr__'):
+            return (t.__new__, (t,), obj.__dict__, None, None, _RestoreState)
+
+        return NotImplemented
+
+class _ModuleUnpickler(pickle.Unpickler):
+    def __init__(self, file, circuit):
+        super().__init__(file)
+        self.circuit = circuit
+
+    def persistent_load(self, pid):
+        (tag, name) = pid
+        assert tag == 'module'
+        registry = self.circuit.registry
+        return registry.modules[registry.names[name]]
+
+class ElaborationCache(object):
+    """Persistent on-disk cache of elaborated modules.
+
+    Pass an instance to Context() to enable it. Each module is stored under a
+    digest of the Atlas version and sources, the source file of its generator,
+    its canonical arguments, the values it closes over (for generators made by
+    a factory function) and the circuit's default clock / reset settings
+    (which add ports to Io()s and instances). On a later run, a generator call
+    whose digest is on disk is reloaded instead of re-running its body.
+
+    Generators are identified on disk by __module__ and __qualname__ (function
+    objects don't survive across runs). Submodules reloaded along with a cached
+    module are registered under a placeholder key ('disk', digest) until their
+    generator is called directly, see Adopt().
+
+    N.B. Only the file defining the generator is hashed, not the values of
+    globals it reads. If a generator calls helpers defined in other files or
+    reads globals computed at run time, changing those will not invalidate the
+    cache; call Clear() in that case.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.disk_keys = {}
+        self.code_hashes = {}
+        self.atlas_hash = None
+
+        os.makedirs(path, exist_ok=True)
+
+    def HitRate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def __str__(self):
+        return f'ElaborationCache({self.path}): ' + \
+            f'{self.hits} hits, {self.misses} misses, {self.stores} stores ' + \
+            f'({self.HitRate() * 100:.1f}% hit rate)'
+
+    def Clear(self):
+        for filename in glob.glob(os.path.join(self.path, '*.atlas')):
+            os.remove(filename)
+
+    def AtlasHash(self):
+        if self.atlas_hash is None:
+            from .. import __version__
+
+            atlas_dir = os.path.dirname(os.path.dirname(__file__))
+            h = sha256(__version__.encode('utf-8'))
+
+            for filename in sorted(glob.glob(f'{atlas_dir}/**/*.py', recursive=True)):
+                with open(filename, 'rb') as f:
+                    h.update(f.read())
+
+            self.atlas_hash = h.hexdigest()
+
+        return self.atlas_hash
+
+    def CodeHash(self, func):
+        if func not in self.code_hashes:
+            h = sha256(func.__qualname__.encode('utf-8'))
+
+            try:
+                with open(inspect.getsourcefile(func), 'rb') as f:
+                    h.update(f.read())
+            except (TypeError, OSError):
+                h.update(marshal.dumps(func.__code__))
+
+            self.code_hashes[func] = h.hexdigest()
+
+        return self.code_hashes[func]
+
+    def StableForm(self, circuit, form):
+        """Convert a canonical form into one that is stable across runs."""
+
+        tag = form[0]
+
+        if tag in { 'object', 'identity' }:
+            raise _Uncacheable()
+
+        elif tag == 'Module':
+            key = circuit.registry.names.get(form[1])
+            if self.disk_keys.get(key) is None:
+                raise _Uncacheable()
+            return ('Module', self.disk_keys[key])
+
+        elif tag in { 'tuple', 'list' }:
+            return (tag, tuple(self.StableForm(circuit, x) for x in form[1]))
+
+        elif tag == 'dict':
+            return (tag, tuple(
+                (self.StableForm(circuit, k), self.StableForm(circuit, v))
+                for (k, v) in form[1]))
+
+        elif tag == 'List':
+            return (tag, form[1], self.StableForm(circuit, form[2]), form[3])
+
+        elif tag == 'Bundle':
+            return (tag, self.StableForm(circuit, form[1]), form[2])
+
+        else:
+            return form
+
+    def ClosureForm(self, func):
+        """Canonical form of the values a generator closes over."""
+
+        if func.__closure__ is None:
+            return CanonicalForm(())
+
+        try:
+            values = tuple(cell.cell_contents for cell in func.__closure__)
+        except ValueError:
+            raise _Uncacheable()
+
+        return CanonicalForm(values)
+
+    def DiskKey(self, circuit, func, key):
+        """Produce the on-disk digest for a module key or None."""
+
+        try:
+            stable_args = (
+                self.StableForm(circuit, key[1]),
+                self.StableForm(circuit, key[2]),
+                self.StableForm(circuit, self.ClosureForm(func)))
+        except _Uncacheable:
+            return None
+
+        return sha256(repr((
+            self.AtlasHash(),
+            self.CodeHash(func),
+            func.__module__,
+            func.__qualname__,
+            circuit.config.default_clock,
+            circuit.config.default_reset,
+            stable_args)).encode('utf-8')).hexdigest()
+
+    def Adopt(self, circuit, key, disk_key):
+        """Re-key a module reloaded as a submodule under its real key.
+
+        Returns the module or None if disk_key was not reloaded that way.
+        """
+
+        if disk_key is None:
+            return None
+
+        registry = circuit.registry
+        module = registry.modules.pop(('disk', disk_key), None)
+
+        if module is None:
+            return None
+
+        registry.modules[key] = module
+        registry.names[module.name] = key
+        self.disk_keys[key] = disk_key
+        return module
+
+    def Filename(self, disk_key):
+        return os.path.join(self.path, f'{disk_key}.atlas')
+
+    def Load(self, circuit, key, disk_key, name):
+        """Load a module (and any submodules it created) from disk.
+
+        Returns None on a miss. The returned module is not yet registered with
+        the circuit but all of its new submodules are.
+        """
+
+        module = self.LoadEntry(circuit, key, disk_key, name)
+
+        if module is None:
+            self.misses += 1
+
+        return module
+
+    def LoadEntry(self, circuit, key, disk_key, name):
+        self.disk_keys[key] = disk_key
+
+        if disk_key is None:
+            return None
+
+        try:
+            with open(self.Filename(disk_key), 'rb') as f:
+                data = zlib.decompress(f.read())
+        except (OSError, zlib.error):
+            return None
+
+        file = io.BytesIO(data)
+        (cached_name, children) = pickle.load(file)
+
+        if cached_name != name:
+            return None
+
+        registry = circuit.registry
+
+        for (child_disk_key, child_name) in children:
+            if child_name in registry.names:
+                if self.disk_keys.get(registry.names[child_name]) != \
+                    child_disk_key:
+                    return None
+
+                continue
+
+            child_key = ('disk', child_disk_key)
+            child = self.LoadEntry(circuit, child_key, child_disk_key, child_name)
+
+            if child is None:
+                return None
+
+            RegistryInsert(circuit, child_key, child)
+
+        try:
+            module = _ModuleUnpickler(file, circuit).load()
+        except KeyError:
+            return None
+
+        self.hits += 1
+        return module
+
+    def Store(self, circuit, key, disk_key, module, children):
+        """Store a freshly elaborated module.
+
+        children -- modules registered while elaborating this one (in order)
+        """
+
+        self.disk_keys[key] = disk_key
+
+        if disk_key is None:
+            return
+
+        child_entries = []
+
+        for child in children:
+            child_key = circuit.registry.names[child.name]
+            child_disk_key = self.disk_keys.get(child_key)
+
+            if child_disk_key is None:
+                self.disk_keys[key] = None
+                return
+
+            child_entries.append((child_disk_key, child.name))
+
+        file = io.BytesIO()
+        pickle.dump((module.name, child_entries), file, pickle.HIGHEST_PROTOCOL)
+        _ModulePickler(file, module).dump(module)
+
+        filename = self.Filename(disk_key)
+        tmp_filename = f'{filename}.{os.getpid()}.tmp'
+
+        with open(tmp_filename, 'wb') as f:
+            f.write(zlib.compress(file.getvalue()))
+
+        os.replace(tmp_filename, filename)
+        self.stores += 1
@@ -1,5 +1,4 @@
 from contextlib import contextmanager
-from hashlib import sha256
 
 from ..base import *
 
@@ -9,6 +8,7 @@ context = []
 prevcondition = []
 optable = []
 temp_num = 0
+elab_cache = None
 
 def NewWireName():
     global temp_num
@@ -22,19 +22,34 @@ def NewRegName():
     temp_num += 1
     return name
 
-def Circuit(name : str, default_clock=False, default_reset=False):
-    return M.Circuit(name, M.CircuitConfig(default_clock, default_reset))
+def Circuit(
+    name : str,
+    default_clock=False,
+    default_reset=False,
+    comb_style=M.CombStyle.ASSIGN):
+
+    return M.Circuit(
+        name,
+        M.CircuitConfig(default_clock, default_reset, comb_style))
 
 @contextmanager
-def Context(_circuit : M.Circuit):
+def Context(_circuit : M.Circuit, cache=None):
+    """Elaborate modules into _circuit.
+
+    cache -- optional ElaborationCache used to reload unchanged modules
+    """
+
     global circuit
+    global elab_cache
     assert circuit is None
     circuit = _circuit
+    elab_cache = cache
 
     yield
 
     assert circuit == _circuit
     circuit = None
+    elab_cache = None
 
 def CurrentCircuit():
     global circuit
@@ -98,33 +113,68 @@ def ConnectionContext():
     assert len(CurrentPredicate()) == 0
     PopContext()
 
+@contextmanager
+def NameScope():
+    """Give a module body its own wire/reg and operator name counters.
+
+    Names only need to be unique within a module, so each module starts
+    counting from zero. This keeps a module's generated names independent of
+    whatever was elaborated before it (which is what lets the elaboration cache
+    reload a module and get exactly what re-running it would produce).
+    """
+
+    global temp_num
+    saved_temp_num = temp_num
+    saved_name_uid_map = Operator.name_uid_map
+
+    temp_num = 0
+    Operator.name_uid_map = {}
+
+    yield
+
+    temp_num = saved_temp_num
+    Operator.name_uid_map = saved_name_uid_map
+
 def Module(func):
     def ModuleWrapper(*args, **kwargs):
         global modules
         global circuit
+        global elab_cache
 
-        module_name = func.__name__
+        key = ModuleKey(func, args, kwargs)
+        m = RegistryLookup(circuit, key)
 
-        if (args != ()) or (kwargs != {}):
-            uid = sha256(f'{args}, {kwargs}'.encode('utf-8')).hexdigest()[0:4]
-            module_name = func.__name__ + '_' + uid
+        if m is not None:
+            return m
 
-        m = None
+        if elab_cache is not None:
+            disk_key = elab_cache.DiskKey(circuit, func, key)
+            m = elab_cache.Adopt(circuit, key, disk_key)
 
-        for module in circuit.modules:
-            if module.name == module_name:
-                m = module
+            if m is not None:
+                return m
+
+        has_args = (args != ()) or (kwargs != {})
+        module_name = RegistryName(circuit, func.__name__, key, has_args)
+
+        if elab_cache is not None:
+            m = elab_cache.Load(circuit, key, disk_key, module_name)
 
         if m is None:
+            first_new = len(circuit.modules)
             modules.append(model.Module(module_name))
 
-            with ConnectionContext():
+            with ConnectionContext(), NameScope():
                 func(*args, **kwargs)
 
             assert len(modules) > 0
             m = modules.pop()
-            circuit.modules.append(m)
 
+            if elab_cache is not None:
+                elab_cache.Store(
+                    circuit, key, disk_key, m, circuit.modules[first_new:])
+
+        RegistryInsert(circuit, key, m)
         return m
 
     return ModuleWrapper
@@ -1,2 +1,5 @@
+from .buildcache import *
+from .monitor import *
 from .testbench import *
+from .shard import *
 from .verilator import *
\ No newline at end of file
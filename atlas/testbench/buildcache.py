@@ -0,0 +1,91 @@
+import glob
+import os
+import shutil
+
+__all__ = ['BuildCache', 'DefaultBuildCache']
+
+class BuildCache(object):
+    """Content-addressed cache of compiled simulator libraries.
+
+    Each entry is a single shared object stored as <path>/<key>.so, where key
+    is a digest of everything that went into the build (see BuildKey in
+    verilator.py). Entries are touched whenever they are used and the least
+    recently used ones are evicted once the cache grows past max_bytes.
+    """
+
+    def __init__(self, path, max_bytes=1 << 30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(path, exist_ok=True)
+
+    def Filename(self, key, ext='.so'):
+        return os.path.join(self.path, f'{key}{ext}')
+
+    def Lookup(self, key):
+        """Return the cached library for key or None."""
+
+        filename = self.Filename(key)
+
+        if not os.path.exists(filename):
+            self.misses += 1
+            return None
+
+        os.utime(filename)
+        self.hits += 1
+        return filename
+
+    def Store(self, key, so_name):
+        """Copy a freshly built library into the cache and return its path."""
+
+        filename = self.Filename(key)
+        tmp_filename = f'{filename}.{os.getpid()}.tmp'
+
+        shutil.copyfile(so_name, tmp_filename)
+        os.replace(tmp_filename, filename)
+
+        self.Evict(keep=filename)
+        return filename
+
+    def Evict(self, keep=None):
+        """Delete least recently used entries until under max_bytes."""
+
+        entries = []
+
+        for filename in glob.glob(os.path.join(self.path, '*.so')):
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+
+            entries.append((st.st_mtime, st.st_size, filename))
+
+        total = sum(size for (_, size, _) in entries)
+
+        for (_, size, filename) in sorted(entries):
+            if total <= self.max_bytes:
+                break
+
+            if filename == keep:
+                continue
+
+            try:
+                os.remove(filename)
+                total -= size
+            except OSError:
+                pass
+
+    def Clear(self):
+        for filename in glob.glob(os.path.join(self.path, '*.so')):
+            os.remove(filename)
+
+def DefaultBuildCache():
+    """Build cache in $ATLAS_CACHE_DIR (default ~/.cache/atlas)/verilator."""
+
+    cache_dir = os.environ.get(
+        'ATLAS_CACHE_DIR',
+        os.path.join(os.path.expanduser('~'), '.cache', 'atlas'))
+
+    return BuildCache(os.path.join(cache_dir, 'verilator'))
@@ -0,0 +1,228 @@
+from dataclasses import dataclass
+import re
+
+__all__ = [
+    'MonExpr',
+    'MonIo',
+    'MonNot',
+    'MonImplies',
+    'Monitor',
+    'MonAssert',
+    'MonCounter',
+    'MonitorResult',
+    'MonitorKind',
+    'GenerateMonitors',
+]
+
+class MonExpr(object):
+    """An expression over IO signals that is compiled into the testbench.
+
+    Built from MonIo() and Python ints with the usual operators (except ~),
+    MonNot and MonImplies, e.g. (MonIo('io_count') + 1) == MonIo('io_next').
+    Values are unsigned 64-bit integers; comparisons produce 0 or 1.
+
+    N.B. == and != build expressions, so MonExprs can't be used as dict keys.
+    """
+
+    __hash__ = None
+
+    def __init__(self, code, io_names=frozenset()):
+        self.code = code
+        self.io_names = io_names
+
+    def BinaryOp(self, other, op):
+        other = AsMonExpr(other)
+        return MonExpr(
+            f'({self.code} {op} {other.code})',
+            self.io_names | other.io_names)
+
+    def __eq__(self, other): return self.BinaryOp(other, '==')
+    def __ne__(self, other): return self.BinaryOp(other, '!=')
+    def __lt__(self, other): return self.BinaryOp(other, '<')
+    def __le__(self, other): return self.BinaryOp(other, '<=')
+    def __gt__(self, other): return self.BinaryOp(other, '>')
+    def __ge__(self, other): return self.BinaryOp(other, '>=')
+    def __and__(self, other): return self.BinaryOp(other, '&')
+    def __or__(self, other): return self.BinaryOp(other, '|')
+    def __xor__(self, other): return self.BinaryOp(other, '^')
+    def __add__(self, other): return self.BinaryOp(other, '+')
+    def __sub__(self, other): return self.BinaryOp(other, '-')
+
+    #
+    # Expressions are 64 bits wide, so ~ on a narrow IO would set all of its
+    # upper bits (~MonIo('io_done') is never 0). Use MonNot instead.
+    #
+
+    def __invert__(self):
+        assert False, 'Use MonNot(expr) instead of ~ in monitor expressions'
+
+def AsMonExpr(item):
+    if type(item) is MonExpr:
+        return item
+
+    assert type(item) in { bool, int }, \
+        f'Cannot use {type(item)} in a monitor expression'
+
+    assert int(item) >= 0, 'Monitor constants must be non-negative'
+    return MonExpr(f'UINT64_C({int(item)})')
+
+def MonIo(name):
+    """Value of a top-level IO (by its Verilog name, e.g. 'io_done')."""
+
+    return MonExpr(f'((uint64_t)f.{name})', frozenset([name]))
+
+def MonNot(expr):
+    expr = AsMonExpr(expr)
+    return MonExpr(f'(!{expr.code})', expr.io_names)
+
+def MonImplies(cond, expr):
+    """Holds if cond is false or expr is true."""
+
+    cond = AsMonExpr(cond)
+    expr = AsMonExpr(expr)
+    return MonExpr(
+        f'(!{cond.code} || {expr.code})',
+        cond.io_names | expr.io_names)
+
+class MonitorKind(object):
+    ASSERT = 0
+    COUNTER = 1
+
+@dataclass(frozen=True, eq=False)
+class Monitor(object):
+    """A check evaluated natively after every cycle (outside of reset).
+
+    Fields:
+    name -- name the results are reported under
+    kind -- MonitorKind
+    expr -- the MonExpr being checked / counted
+    stop -- (asserts) stop the simulation at the first failure
+    """
+
+    name : str
+    kind : int
+    expr : MonExpr
+    stop : bool = True
+
+    def __post_init__(self):
+
+        #
+        # The name is pasted into the generated C++ (a string literal and a
+        # comment), so it has to be a plain identifier.
+        #
+
+        assert re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', self.name), \
+            f'Monitor names must be plain identifiers: {self.name!r}'
+
+def MonAssert(name, cond, stop=True):
+    """Check that cond holds every cycle.
+
+    Failures are counted and the first failing cycle is recorded. With stop,
+    the simulation loop returns at the first failure and the Testbench call
+    that was running fails.
+    """
+
+    return Monitor(name, MonitorKind.ASSERT, AsMonExpr(cond), stop)
+
+def MonCounter(name, cond):
+    """Count the cycles cond holds (and record the first)."""
+
+    return Monitor(name, MonitorKind.COUNTER, AsMonExpr(cond), False)
+
+@dataclass
+class MonitorResult(object):
+    """Outcome of a monitor so far.
+
+    count -- cycles a MonAssert failed / a MonCounter's condition held
+    first_cycle -- cycle number (as in Testbench.Cycle()) of the first of
+        those or None
+    """
+
+    name : str
+    kind : int
+    count : int
+    first_cycle : int
+
+def GenerateMonitors(monitors, io_widths):
+    """C++ for check_monitors() and the monitor tables of a testbench.
+
+    io_widths -- dict of IO name -> width, used to validate the monitors
+    """
+
+    names = set()
+    checks = []
+
+    for (i, monitor) in enumerate(monitors):
+        assert monitor.name not in names, \
+            f'Duplicate monitor name: {monitor.name}'
+        names.add(monitor.name)
+
+        for io_name in monitor.expr.io_names:
+            assert io_name in io_widths, \
+                f'Monitor {monitor.name}: no such IO: {io_name}'
+            assert io_widths[io_name] <= 64, \
+                f'Monitor {monitor.name}: {io_name} is wider than 64 bits'
+
+        code = monitor.expr.code
+
+        if monitor.kind == MonitorKind.ASSERT:
+            cond = f'!{code}'
+            stop = f'        if (!sim->stop) sim->stop = {i + 1};\n' \
+                if monitor.stop else ''
+        else:
+            cond = code
+            stop = ''
+
+        checks.append(
+            f'    // {monitor.name}\n' +
+            f'    if ({cond}) {{\n' +
+            f'        if (sim->mon_count[{i}]++ == 0)\n' +
+            f'            sim->mon_first[{i}] = sim->cycle;\n' +
+            stop +
+            f'    }}\n')
+
+    table = ''.join([
+        f'    names[{i}] = "{monitor.name}";\n' +
+        f'    kinds[{i}] = {monitor.kind};\n'
+        for (i, monitor) in enumerate(monitors)
+    ])
+
+    return f"""
+//
+// Monitors, checked after every cycle outside of reset. sim->stop is set to
+// 1 + the index of the first stopping MonAssert that failed.
+//
+
+static inline void check_monitors(Sim * sim) {{
+    const IoFrame & f = sim->frame;
+    (void)f;
+
+{''.join(checks)}}}
+
+EXPORT int num_monitors() {{
+    return NUM_MONITORS;
+}}
+
+EXPORT void monitor_table(const char ** names, int * kinds) {{
+{table}}}
+
+EXPORT void monitor_results(Sim * sim, uint64_t * counts, uint64_t * first) {{
+    for (int i = 0; i < NUM_MONITORS; i++) {{
+        counts[i] = sim->mon_count[i];
+        first[i] = sim->mon_first[i];
+    }}
+}}
+
+EXPORT void clear_monitors(Sim * sim) {{
+    for (int i = 0; i < NUM_MONITORS; i++) {{
+        sim->mon_count[i] = 0;
+        sim->mon_first[i] = 0;
+    }}
+
+    sim->stop = 0;
+}}
+
+EXPORT int32_t * monitor_stop(Sim * sim) {{
+    return &sim->stop;
+}}
+"""
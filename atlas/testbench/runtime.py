@@ -0,0 +1,164 @@
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+
+__all__ = [
+    'ParseMakeVars',
+    'RuntimeSources',
+    'RuntimeDefines',
+    'RuntimeArchive',
+]
+
+#
+# Runtime sources to fall back on if the generated makefiles can't be read.
+# Tracing and save / restore sources are only added if the model uses them.
+#
+
+default_runtime_sources = ['verilated']
+
+#
+# Make variables from V<top>_classes.mk that the runtime is compiled against.
+# They must match between the runtime and the model.
+#
+
+runtime_define_vars = [
+    'VM_COVERAGE',
+    'VM_SC',
+    'VM_TIMING',
+    'VM_TRACE',
+    'VM_TRACE_FST',
+    'VM_TRACE_VCD',
+    'VM_TRACE_SAIF',
+]
+
+def ParseMakeVars(filename):
+    """Read simple (=, += and :=) variable assignments from a makefile.
+
+    Returns a dict mapping variable name to its list of whitespace separated
+    words.
+    """
+
+    with open(filename) as f:
+        text = f.read().replace('\\\n', ' ')
+
+    make_vars = {}
+
+    for line in text.splitlines():
+        m = re.match(r'^\s*([A-Za-z_][A-Za-z0-9_]*)\s*(\+=|:=|\?=|=)(.*)$', line)
+        if m is None:
+            continue
+
+        (name, op, value) = m.groups()
+        words = value.split('#')[0].split()
+
+        if op == '+=':
+            make_vars.setdefault(name, []).extend(words)
+        elif (op != '?=') or (name not in make_vars):
+            make_vars[name] = words
+
+    return make_vars
+
+def RuntimeSources(make_vars, trace=False, trace_fst=False, savable=False):
+    """Runtime sources (names without .cpp) a Verilated model needs.
+
+    trace, trace_fst and savable (as in VeriOpts) pick the fallback sources
+    used when make_vars doesn't list them.
+    """
+
+    sources = \
+        make_vars.get('VM_GLOBAL_FAST', []) + make_vars.get('VM_GLOBAL_SLOW', [])
+
+    if len(sources) > 0:
+        return sources
+
+    sources = list(default_runtime_sources)
+
+    if trace:
+        sources.append('verilated_fst_c' if trace_fst else 'verilated_vcd_c')
+
+    if savable:
+        sources.append('verilated_save')
+
+    return sources
+
+def RuntimeDefines(make_vars, verilator_version=''):
+    """Preprocessor flags the runtime must be compiled with for this model."""
+
+    defines = [
+        f'-D{name}={make_vars[name][0]}'
+        for name in runtime_define_vars
+        if len(make_vars.get(name, [])) > 0
+    ]
+
+    #
+    # Verilator 4 only builds the thread-safe runtime when asked to. Verilator 5
+    # is always threaded.
+    #
+
+    threads = make_vars.get('VM_THREADS', ['0'])
+    if (threads != ['0']) and verilator_version.startswith('Verilator 4'):
+        defines.append('-DVL_THREADED')
+
+    return defines
+
+def RuntimeArchive(
+    cache_dir,
+    vinc,
+    sources,
+    cflags,
+    verilator_version,
+    jobs=None,
+    cxx=None):
+    """Return an archive of the Verilator runtime, building it if needed.
+
+    The archive is compiled once per (Verilator version, sources, flags) and
+    kept in cache_dir as runtime-<digest>.a so every design built with the same
+    configuration can link it instead of compiling the runtime again.
+    """
+
+    if cxx is None:
+        cxx = ['g++']
+
+    key = sha256(repr((
+        verilator_version,
+        vinc,
+        sorted(sources),
+        cflags,
+        cxx)).encode('utf-8')).hexdigest()
+
+    archive_name = os.path.join(cache_dir, f'runtime-{key}.a')
+
+    if os.path.exists(archive_name):
+        return archive_name
+
+    os.makedirs(cache_dir, exist_ok=True)
+    obj_dir = tempfile.mkdtemp(dir=cache_dir)
+
+    def Compile(source):
+        obj_name = os.path.join(obj_dir, f'{source}.o')
+        subprocess.run(
+            cxx + cflags + [
+                '-I', vinc,
+                '-I', f'{vinc}/vltstd',
+                '-c', os.path.join(vinc, f'{source}.cpp'),
+                '-o', obj_name
+            ],
+            check=True)
+        return obj_name
+
+    try:
+        with ThreadPoolExecutor(jobs or os.cpu_count()) as pool:
+            obj_names = list(pool.map(Compile, sources))
+
+        tmp_archive_name = os.path.join(obj_dir, 'runtime.a')
+        subprocess.run(['ar', 'rcs', tmp_archive_name] + obj_names, check=True)
+        os.replace(tmp_archive_name, archive_name)
+
+    finally:
+        shutil.rmtree(obj_dir, ignore_errors=True)
+
+    return archive_name
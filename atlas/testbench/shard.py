@@ -0,0 +1,109 @@
+from dataclasses import dataclass, field
+import traceback
+
+from ..base import *
+from .testbench import *
+
+__all__ = ['ShardStats', 'RunSharded']
+
+@dataclass
+class ShardStats(object):
+    """Aggregate outcome of RunSharded.
+
+    Fields:
+    passed -- number of cases that returned without raising
+    failed -- number of cases that raised
+    cycles -- total clock cycles simulated across all workers
+    results -- return value of the test function for each case (in order, None
+        for failed cases)
+    failures -- list of (case index, case, formatted exception)
+    """
+
+    passed : int = 0
+    failed : int = 0
+    cycles : int = 0
+    results : list = field(default_factory=list)
+    failures : list = field(default_factory=list)
+
+    def __str__(self):
+        return f'{self.passed} passed, {self.failed} failed, ' + \
+            f'{self.cycles} cycles'
+
+#
+# The simulator instance of this (worker) process, loaded once by ShardInit.
+#
+
+shard_tb = None
+
+def ShardInit(circuit, so_name):
+    global shard_tb
+    shard_tb = Testbench(circuit, so_name)
+
+def ShardRun(test_func, chunk):
+    results = []
+
+    for (index, case) in chunk:
+        start_cycles = shard_tb.cycles
+
+        try:
+            value = test_func(shard_tb, case)
+            error = None
+        except Exception:
+            value = None
+            error = traceback.format_exc()
+
+        results.append((index, value, error, shard_tb.cycles - start_cycles))
+
+    return results
+
+def RunSharded(circuit, so_name, test_func, cases, jobs=None, chunk_size=16):
+    """Run test_func(tb, case) for every case across a pool of processes.
+
+    circuit -- the circuit so_name was compiled from
+    so_name -- compiled simulator library (e.g. from VeriCompile)
+    test_func -- called with a Testbench and one case. It fails the case by
+        raising (e.g. an assert) and its return value is collected.
+    cases -- iterable of (picklable) test cases
+    jobs -- number of worker processes (None for one per core)
+    chunk_size -- number of cases handed to a worker at a time
+
+    Each worker creates a single Testbench and runs every case it is given on
+    it, so test_func should put the design into a known state (e.g. with
+    tb.Reset()) itself. Returns a ShardStats.
+
+    Chunks are run in worker processes through ForkMap (sequentially in this
+    process if it can't fork).
+    """
+
+    global shard_tb
+
+    indexed = list(enumerate(cases))
+    chunks = [
+        indexed[i:i + chunk_size] for i in range(0, len(indexed), chunk_size)
+    ]
+
+    try:
+        chunk_results = ForkMap(
+            lambda chunk: ShardRun(test_func, chunk),
+            chunks,
+            jobs,
+            initializer=lambda: ShardInit(circuit, so_name))
+
+    finally:
+        shard_tb = None
+
+    stats = ShardStats(results=[None] * len(indexed))
+
+    for results in chunk_results:
+        for (index, value, error, cycles) in results:
+            stats.cycles += cycles
+            stats.results[index] = value
+
+            if error is None:
+                stats.passed += 1
+            else:
+                stats.failed += 1
+                stats.failures.append((index, indexed[index][1], error))
+
+    stats.failures.sort(key=lambda failure: failure[0])
+    return stats
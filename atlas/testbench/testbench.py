@@ -1,11 +1,14 @@
 import math
 from ctypes import *
 from contextlib import contextmanager
+import os
 import shutil
 
 from ..frontend import *
 from ..base import *
 
+from .buildcache import *
+from .monitor import *
 from .verilator import *
 
 class SignalTestbench(object):
@@ -24,16 +27,38 @@ class SignalTestbench(object):
         pass
 
 
+#
+# memoryview formats of IoFrame fields by size (wider fields are handled as raw
+# bytes).
+#
+
+frame_formats = { 1: 'B', 2: 'H', 4: 'I', 8: 'Q' }
+
 class BitsTestbench(SignalTestbench):
-    """Wrapper class for a M.BitsSignal that adds testbench functionality."""
+    """Wrapper class for a M.BitsSignal that adds testbench functionality.
+
+    Values are read and written directly in the testbench's IoFrame through a
+    memoryview, without calling into the simulator.
+    """
 
     def __init__(self, signal, tb):
         assert type(signal) is M.BitsSignal
         super().__init__(signal)
         self.tb = tb
         self.num_bytes = (self.width + 7) // 8
-        self.buf = create_string_buffer(self.num_bytes)
-        self.sig_ptr = tb.LookupIo(VName(self.signal))
+        self.mask = (1 << self.width) - 1
+
+        name = tb.symbols.Name(self.signal)
+        assert name in tb.io_handles, f'No such IO in the model: {name}'
+
+        (self.sig_ptr, size) = tb.io_handles[name]
+        offset = self.sig_ptr - tb.frame_addr
+        self.raw = tb.frame_mem[offset:offset + size]
+
+        if size in frame_formats:
+            self.view = self.raw.cast(frame_formats[size])
+        else:
+            self.view = None
 
     def __ilshift__(self, val):
         self.SetValue(val)
@@ -41,10 +66,17 @@ class BitsTestbench(SignalTestbench):
 
     def SetValue(self, val):
         assert type(val) is int
-        self.tb.WriteIo(self.sig_ptr, val, self.num_bytes)
+
+        if self.view is not None:
+            self.view[0] = val & self.mask
+        else:
+            self.raw[:] = (val & self.mask).to_bytes(len(self.raw), 'little')
 
     def GetValue(self):
-        return self.tb.ReadIo(self.sig_ptr, self.num_bytes)
+        if self.view is not None:
+            return self.view[0]
+
+        return int.from_bytes(self.raw, 'little')
 
 
 class ListTestbench(SignalTestbench):
@@ -116,46 +148,675 @@ def WrapTbSignal(signal, tb):
     else:
         assert False, f'Cannot wrap signal of type {type(signal)}'
 
+def TbLeaves(wrapper):
+    """Flatten a testbench wrapper into its BitsTestbench leaves."""
+
+    if type(wrapper) is BitsTestbench:
+        return [wrapper]
+    elif type(wrapper) is ListTestbench:
+        fields = wrapper.wrap_fields
+    elif type(wrapper) is BundleTestbench:
+        fields = wrapper.wrap_fields.values()
+    elif type(wrapper) is IoTestbench:
+        fields = wrapper.io_dict.values()
+    else:
+        assert False, f'Cannot flatten {type(wrapper)}'
+
+    return [leaf for field in fields for leaf in TbLeaves(field)]
+
+class IoGroup(object):
+    """A fixed group of testbench signals that are read / written together.
+
+    Signal handles are resolved once, up front, and every Poke() or Peek() is
+    a single native call. Values are passed as 64-bit words: signals wider than
+    64 bits take several words internally but are still poked and peeked as a
+    single Python int. Poked values are masked to each signal's width.
+    """
+
+    def __init__(self, tb, signals):
+        self.tb = tb
+        self.leaves = [leaf for sig in signals for leaf in TbLeaves(sig)]
+        self.n = len(self.leaves)
+        self.num_words = [(leaf.num_bytes + 7) // 8 for leaf in self.leaves]
+        self.masks = [leaf.mask for leaf in self.leaves]
+        self.np_masks = None
+        self.wide = any(words > 1 for words in self.num_words)
+        self.total_words = sum(self.num_words)
+
+        self.sig_ptrs = (c_void_p * self.n)(*[
+            leaf.sig_ptr for leaf in self.leaves
+        ])
+
+        self.sizes = (c_int * self.n)(*[leaf.num_bytes for leaf in self.leaves])
+        self.write_buf = (c_uint64 * self.total_words)()
+        self.read_buf = (c_uint64 * self.total_words)()
+
+    def __len__(self):
+        return self.n
+
+    def ToWords(self, values):
+        words = []
+
+        for (val, num_words, mask) in zip(values, self.num_words, self.masks):
+            val = int(val) & mask
+            words += [
+                (val >> (64 * i)) & 0xFFFFFFFFFFFFFFFF for i in range(num_words)
+            ]
+
+        return words
+
+    def FromWords(self, words):
+        values = []
+        offset = 0
+
+        for num_words in self.num_words:
+            val = 0
+            for i in range(num_words):
+                val |= words[offset + i] << (64 * i)
+
+            values.append(val)
+            offset += num_words
+
+        return tuple(values)
+
+    def Poke(self, values):
+        """Write one value per signal (a sequence of ints or a NumPy array)."""
+
+        assert len(values) == self.n
+
+        if (not self.wide) and hasattr(values, '__array__'):
+            import numpy as np
+
+            if self.np_masks is None:
+                self.np_masks = np.array(self.masks, dtype=np.uint64)
+
+            arr = np.asarray(values, dtype=np.uint64) & self.np_masks
+            self.tb.so.write_ios(
+                self.n, self.sig_ptrs, self.sizes, c_void_p(arr.ctypes.data))
+            return
+
+        if self.wide:
+            self.write_buf[:] = self.ToWords(values)
+        else:
+            self.write_buf[:] = [
+                int(val) & mask for (val, mask) in zip(values, self.masks)
+            ]
+
+        self.tb.so.write_ios(self.n, self.sig_ptrs, self.sizes, self.write_buf)
+
+    def Peek(self):
+        """Read all signals and return their values as a tuple of ints."""
+
+        self.tb.so.read_ios(self.n, self.sig_ptrs, self.sizes, self.read_buf)
+
+        if not self.wide:
+            return tuple(self.read_buf)
+
+        return self.FromWords(self.read_buf)
+
+    def PeekArray(self):
+        """Read all signals into a NumPy uint64 array (requires numpy).
+
+        Only valid for groups of signals that are at most 64 bits wide.
+        """
+
+        import numpy as np
+
+        assert not self.wide, 'PeekArray() requires signals <= 64 bits wide'
+        arr = np.zeros(self.n, dtype=np.uint64)
+        self.tb.so.read_ios(
+            self.n, self.sig_ptrs, self.sizes, c_void_p(arr.ctypes.data))
+        return arr
+
+
+def LoadSimLibrary(so_name):
+    """Load a simulator library and declare the signatures of its exports."""
+
+    so = cdll.LoadLibrary(so_name)
+
+    so.create.restype = c_void_p
+    so.io_frame.restype = c_void_p
+    so.io_frame.argtypes = [c_void_p]
+    so.destroy.argtypes = [c_void_p]
+    so.open_trace.argtypes = [c_void_p, c_char_p, c_int, c_void_p, c_int]
+    so.close_trace.argtypes = [c_void_p]
+    so.trace_on.argtypes = [c_void_p, c_int]
+    so.trace_window.argtypes = [c_void_p, c_uint64, c_uint64]
+    so.cycle.restype = c_uint64
+    so.cycle.argtypes = [c_void_p]
+    so.capture.argtypes = [
+        c_void_p, c_int, c_void_p, c_void_p, c_void_p, c_uint64
+    ]
+    so.capture_count.restype = c_uint64
+    so.capture_count.argtypes = [c_void_p]
+    so.monitor_table.argtypes = [c_void_p, c_void_p]
+    so.monitor_results.argtypes = [c_void_p, c_void_p, c_void_p]
+    so.clear_monitors.argtypes = [c_void_p]
+    so.monitor_stop.restype = c_void_p
+    so.monitor_stop.argtypes = [c_void_p]
+    so.io_table.argtypes = [c_void_p, c_void_p, c_void_p, c_void_p]
+    so.reset.argtypes = [c_void_p, c_int]
+    so.step.restype = c_int64
+    so.step.argtypes = [c_void_p, c_int64]
+
+    so.step_until.restype = c_int64
+    so.step_until.argtypes = [
+        c_void_p, c_void_p, c_int, c_uint64, c_uint64, c_int64
+    ]
+
+    so.run.restype = c_int64
+    so.run.argtypes = [
+        c_void_p,
+        c_int64,
+        c_int, c_void_p, c_void_p, c_void_p, c_void_p,
+        c_int, c_void_p, c_void_p, c_void_p
+    ]
+
+    so.save.argtypes = [c_void_p, c_char_p]
+    so.restore.argtypes = [c_void_p, c_char_p]
+    so.snapshot.restype = c_void_p
+    so.snapshot.argtypes = [c_void_p]
+    so.restore_snapshot.argtypes = [c_void_p, c_void_p, c_size_t]
+    so.snapshot_data.restype = c_void_p
+    so.snapshot_data.argtypes = [c_void_p]
+    so.snapshot_size.restype = c_size_t
+    so.snapshot_size.argtypes = [c_void_p]
+    so.free_snapshot.argtypes = [c_void_p]
+
+    return so
+
+class SignalCapture(object):
+    """Per-cycle values of a set of signals, recorded natively.
+
+    Created by Testbench.Capture(). The simulator writes straight into ring, a
+    (depth, number of signals) NumPy uint64 array, so reading captured values
+    does not copy anything out of the simulator. Once more than depth cycles
+    have been captured, only the most recent depth are kept.
+    """
+
+    def __init__(self, tb, signals, depth):
+        import numpy as np
+
+        self.tb = tb
+        self.leaves = [leaf for sig in signals for leaf in TbLeaves(sig)]
+        self.columns = { id(leaf): i for (i, leaf) in enumerate(self.leaves) }
+        self.depth = depth
+        self.start_cycle = tb.Cycle()
+        self.final_count = None
+        self.ring = np.zeros((depth, len(self.leaves)), dtype=np.uint64)
+
+        for leaf in self.leaves:
+            assert leaf.num_bytes <= 8, \
+                f'{tb.symbols.Name(leaf.signal)} is wider than 64 bits'
+
+    def Count(self):
+        """Number of cycles captured so far (including overwritten ones)."""
+
+        if self.final_count is not None:
+            return self.final_count
+
+        return self.tb.so.capture_count(self.tb.sim)
+
+    def Values(self):
+        """Captured rows, oldest first.
+
+        This is a view of ring (no copy) until the ring wraps around.
+        """
+
+        import numpy as np
+
+        count = self.Count()
+
+        if count <= self.depth:
+            return self.ring[:count]
+
+        pos = count % self.depth
+        return np.concatenate((self.ring[pos:], self.ring[:pos]))
+
+    def Cycles(self):
+        """Cycle number (as in Testbench.Cycle()) of each row of Values()."""
+
+        import numpy as np
+
+        count = self.Count()
+        first = self.start_cycle + 1 + max(0, count - self.depth)
+        return np.arange(first, self.start_cycle + 1 + count, dtype=np.uint64)
+
+    def __getitem__(self, signal):
+        """Captured values of one signal, oldest first."""
+
+        return self.Values()[:, self.columns[id(signal)]]
+
+class Snapshot(object):
+    """An in-memory checkpoint of a simulator instance.
+
+    Created by Testbench.Snapshot(). It can be restored into any Testbench
+    using the same library (any number of times) and converted to bytes with
+    bytes(snapshot).
+    """
+
+    def __init__(self, so, handle):
+        self.so = so
+        self.handle = handle
+        self.data = so.snapshot_data(handle)
+        self.size = so.snapshot_size(handle)
+
+    def __len__(self):
+        return self.size
+
+    def __bytes__(self):
+        return string_at(self.data, self.size)
+
+    def __del__(self):
+        if self.handle is not None:
+            self.so.free_snapshot(self.handle)
+            self.handle = None
 
 class Testbench(object):
+    """A single instance of a compiled simulator.
+
+    Each Testbench owns its own instance of the model (a handle returned by the
+    library's create()), so any number of them can be created from the same
+    library in one process. ctypes releases the GIL around every native call,
+    so separate instances can be stepped from separate threads in parallel.
+
+    The number of clock cycles simulated so far is kept in cycles.
+    """
+
     def __init__(self, circuit, so_name):
         self.so = None
+        self.sim = None
         self.so_name = so_name
-        self.so = cdll.LoadLibrary(so_name)
-        self.so.lookup_io.restype = c_void_p
-        self.so.setup()
+        self.circuit = circuit
+        self.so = LoadSimLibrary(so_name)
+        self.sim = self.so.create()
+        self.cycles = 0
+        self.capture = None
+        self.io_handles = self.IoTable()
+
+        self.frame_addr = self.so.io_frame(self.sim)
+        self.frame_mem = memoryview(
+            (c_uint8 * self.so.io_frame_size()).from_address(self.frame_addr)
+        ).cast('B')
+
+        self.frame_array = None
+
+        n = self.so.num_monitors()
+        names = (c_char_p * n)()
+        kinds = (c_int * n)()
+        self.so.monitor_table(names, kinds)
+        self.monitors = [(names[i].decode('ascii'), kinds[i]) for i in range(n)]
+
+        stop_addr = self.so.monitor_stop(self.sim)
+        self.monitor_stop = \
+            memoryview(c_int32.from_address(stop_addr)).cast('B').cast('i')
+
+        self.symbols = ModuleSymbols(circuit.top)
         self.io = IoTestbench(circuit.top.io_dict, self)
 
+    def OpenTrace(self, filename, depth=99, scopes=None):
+        """Start writing a waveform trace to filename.
+
+        depth -- number of levels of hierarchy to trace
+        scopes -- optional list of hierarchical scope names (e.g. 'TOP.foo') to
+            restrict tracing to
+
+        The trace is a VCD file, or an FST file if the library was built with
+        VeriOpts.trace_fst. Use TraceOn / TraceOff / TraceWindow to limit which
+        cycles are dumped.
+        """
+
+        scopes = [] if scopes is None else scopes
+        scope_names = (c_char_p * len(scopes))(*[
+            scope.encode('ascii') for scope in scopes
+        ])
+
+        result = self.so.open_trace(
+            self.sim,
+            os.fsencode(filename),
+            depth,
+            scope_names,
+            len(scopes))
+
+        assert result == 0, \
+            f'{self.so_name} was built without tracing (see VeriOpts.trace)'
+
     def SetupVcd(self, filename):
-        self.so.setup_vcd(c_char_p(filename.encode('ascii')))
+        self.OpenTrace(filename)
+
+    def CloseTrace(self):
+        self.so.close_trace(self.sim)
+
+    def TraceOn(self):
+        self.so.trace_on(self.sim, 1)
+
+    def TraceOff(self):
+        self.so.trace_on(self.sim, 0)
+
+    def TraceWindow(self, start=0, end=None):
+        """Only dump cycles in [start, end) (cycle numbers as in Cycle()).
+
+        To trace the cycles around an event, Restore() a Snapshot taken before
+        it and replay with a window of TraceWindow(event - n, event + n).
+        """
+
+        self.so.trace_window(
+            self.sim, start, end if end is not None else (1 << 64) - 1)
+
+    def Cycle(self):
+        """Current cycle number of the model (restored along with it)."""
+
+        return self.so.cycle(self.sim)
+
+    def Capture(self, signals, depth=4096):
+        """Record signals after every cycle into a native ring buffer.
+
+        signals -- list of testbench signals (at most 64 bits wide each); Lists
+            and Bundles are flattened into their fields
+        depth -- number of most recent cycles to keep
+
+        Returns a SignalCapture (requires numpy). Only one capture can be
+        active at a time; starting a new one replaces it.
+        """
+
+        self.StopCapture()
+
+        capture = SignalCapture(self, signals, depth)
+        n = len(capture.leaves)
+
+        self.so.capture(
+            self.sim,
+            n,
+            (c_void_p * n)(*[leaf.sig_ptr for leaf in capture.leaves]),
+            (c_int * n)(*[leaf.num_bytes for leaf in capture.leaves]),
+            capture.ring.ctypes.data,
+            depth)
+
+        self.capture = capture
+        return capture
+
+    def StopCapture(self):
+        """Stop the active capture (its values stay readable)."""
+
+        if self.capture is None:
+            return
+
+        self.capture.final_count = self.capture.Count()
+        self.so.capture(self.sim, 0, None, None, None, 0)
+        self.capture = None
+
+    def IoTable(self):
+        """Fetch the handle of every IO from the library in one call.
+
+        Returns a dict of IO name -> (address, size in bytes).
+        """
+
+        n = self.so.num_ios()
+        names = (c_char_p * n)()
+        ptrs = (c_void_p * n)()
+        num_bytes = (c_int * n)()
+        self.so.io_table(self.sim, names, ptrs, num_bytes)
+
+        return {
+            names[i].decode('ascii'): (ptrs[i], num_bytes[i]) for i in range(n)
+        }
 
     def LookupIo(self, io_name):
-        cstr = c_char_p(io_name.encode('ascii'))
-        return self.so.lookup_io(cstr)
+        """Return the address of an IO by its exact name (or None)."""
+
+        handle = self.io_handles.get(io_name)
+        return handle[0] if handle is not None else None
 
     def WriteIo(self, sig_ptr, val, num_bytes):
-        arr = val.to_bytes(num_bytes, 'little')
-        self.so.write_io(c_void_p(sig_ptr), arr, num_bytes)
+        offset = sig_ptr - self.frame_addr
+        self.frame_mem[offset:offset + num_bytes] = \
+            val.to_bytes(num_bytes, 'little')
 
     def ReadIo(self, sig_ptr, num_bytes):
-        buf = bytearray(num_bytes)
-        char_array = c_char * len(buf)
-        self.so.read_io(c_void_p(sig_ptr), char_array.from_buffer(buf), num_bytes)
-        return int.from_bytes(buf, 'little')
+        offset = sig_ptr - self.frame_addr
+        return int.from_bytes(self.frame_mem[offset:offset + num_bytes], 'little')
+
+    def Frame(self):
+        """The IoFrame as a 0-d NumPy structured array (requires numpy).
+
+        The array is a view of the simulator's memory: tb.Frame()['io_a'] = 1
+        pokes io_a and reading a field peeks it. Ports wider than 64 bits are
+        arrays of 32-bit words, least significant first. The raw bytes are
+        also available, without numpy, as the memoryview tb.frame_mem.
+        """
+
+        import numpy as np
+
+        if self.frame_array is None:
+            (names, formats, offsets) = ([], [], [])
+
+            for (name, (ptr, size)) in self.io_handles.items():
+                names.append(name)
+                offsets.append(ptr - self.frame_addr)
+
+                if size in frame_formats:
+                    formats.append(np.dtype(f'<u{size}'))
+                else:
+                    formats.append((np.dtype('<u4'), size // 4))
+
+            dtype = np.dtype({
+                'names': names,
+                'formats': formats,
+                'offsets': offsets,
+                'itemsize': len(self.frame_mem)
+            })
+
+            self.frame_array = np.ndarray((), dtype, buffer=self.frame_mem)
+
+        return self.frame_array
+
+    def Group(self, signals=None):
+        """Create an IoGroup over signals (default: every IO of the top).
+
+        signals -- a list of testbench signals (e.g. [tb.io.a, tb.io.b]); Lists
+            and Bundles are flattened into their fields in order
+        """
+
+        if signals is None:
+            signals = [self.io]
+
+        return IoGroup(self, signals)
 
     def Reset(self, num_cycles):
-        self.so.reset(num_cycles)
+        self.so.reset(self.sim, num_cycles)
+        self.cycles += num_cycles
 
     def Step(self, num_cycles):
-        self.so.step(num_cycles)
+        self.cycles += self.so.step(self.sim, num_cycles)
+        self.CheckMonitors()
+
+    def StepUntil(self, signal, value=1, mask=None, max_cycles=1000000):
+        """Step the clock until signal == value (under mask).
+
+        The condition is checked before every cycle (so this returns 0 if it
+        already holds) and the whole loop runs natively. Only the low 64 bits
+        of wider signals are compared.
+
+        Returns the number of cycles stepped. Fails if the condition does not
+        hold within max_cycles.
+        """
+
+        if mask is None:
+            mask = (1 << min(signal.width, 64)) - 1
+
+        cycles = self.so.step_until(
+            self.sim,
+            signal.sig_ptr,
+            signal.num_bytes,
+            value & mask,
+            mask,
+            max_cycles)
+
+        self.cycles += cycles if cycles >= 0 else max_cycles
+        self.CheckMonitors()
+
+        assert cycles >= 0, \
+            f'{self.symbols.Name(signal.signal)} != {value} after ' + \
+            f'{max_cycles} cycles'
+
+        return cycles
+
+    def Run(self, inputs, outputs=None, num_cycles=None):
+        """Drive precomputed stimulus and record responses (requires numpy).
+
+        inputs -- dict of testbench signal -> 1-D array of per-cycle values
+            (e.g. a NumPy array or a np.memmap of a large trace)
+        outputs -- dict of testbench signal -> preallocated, writable 1-D
+            uint64 array that receives the value sampled after every cycle
+        num_cycles -- number of cycles to run (default: length of the inputs)
+
+        Every cycle writes all inputs, steps the clock once and then samples all
+        outputs, i.e. the same as a Python loop of <<=, Step(1) and GetValue(),
+        but the whole loop runs natively. All signals must be at most 64 bits
+        wide and input values are masked to their width.
+        """
+
+        import numpy as np
+
+        if outputs is None:
+            outputs = {}
+
+        in_cols = [
+            np.ascontiguousarray(col, dtype=np.uint64)
+            for col in inputs.values()
+        ]
+
+        if num_cycles is None:
+            assert len(in_cols) > 0, 'num_cycles is required without inputs'
+            num_cycles = len(in_cols[0])
+
+        for col in in_cols:
+            assert len(col) >= num_cycles, 'Input shorter than num_cycles'
+
+        for col in outputs.values():
+            assert (col.dtype == np.uint64) and col.flags.c_contiguous and \
+                col.flags.writeable, 'Outputs must be writable uint64 arrays'
+            assert len(col) >= num_cycles, 'Output shorter than num_cycles'
+
+        def Handles(signals, cols):
+            for signal in signals:
+                assert signal.num_bytes <= 8, \
+                    f'{self.symbols.Name(signal.signal)} is wider than 64 bits'
+
+            n = len(cols)
+            return (
+                n,
+                (c_void_p * n)(*[signal.sig_ptr for signal in signals]),
+                (c_int * n)(*[signal.num_bytes for signal in signals]),
+                (c_void_p * n)(*[col.ctypes.data for col in cols]))
+
+        in_handles = Handles(inputs.keys(), in_cols)
+        in_masks = (c_uint64 * in_handles[0])(*[
+            signal.mask for signal in inputs.keys()
+        ])
+
+        self.cycles += self.so.run(
+            self.sim,
+            num_cycles,
+            *in_handles[0:3],
+            in_masks,
+            in_handles[3],
+            *Handles(outputs.keys(), list(outputs.values())))
+
+        self.CheckMonitors()
+
+    def Monitors(self):
+        """Return a dict of monitor name -> MonitorResult."""
+
+        n = len(self.monitors)
+        counts = (c_uint64 * n)()
+        first = (c_uint64 * n)()
+        self.so.monitor_results(self.sim, counts, first)
+
+        return {
+            name: MonitorResult(
+                name, kind, counts[i], first[i] if counts[i] > 0 else None)
+            for (i, (name, kind)) in enumerate(self.monitors)
+        }
+
+    def ClearMonitors(self):
+        self.so.clear_monitors(self.sim)
+
+    def CheckMonitors(self):
+        """Fail if a stopping MonAssert monitor stopped the simulation."""
+
+        index = self.monitor_stop[0]
+
+        if index == 0:
+            return
+
+        self.monitor_stop[0] = 0
+        name = self.monitors[index - 1][0]
+        result = self.Monitors()[name]
+
+        assert False, \
+            f'Monitor {name} failed at cycle {result.first_cycle}'
+
+    def CheckSavable(self, result):
+        assert result == 0, \
+            f'{self.so_name} was built without save / restore support ' + \
+            '(see VeriOpts.savable)'
+
+    def Snapshot(self):
+        """Checkpoint the model state (and simulation time) in memory."""
+
+        handle = self.so.snapshot(self.sim)
+        self.CheckSavable(0 if handle is not None else -1)
+        return Snapshot(self.so, handle)
+
+    def Save(self, target):
+        """Checkpoint the model to a file path or a writable file object."""
+
+        if isinstance(target, (str, os.PathLike)):
+            self.CheckSavable(self.so.save(self.sim, os.fsencode(target)))
+        else:
+            target.write(bytes(self.Snapshot()))
+
+    def Restore(self, source):
+        """Restore a checkpoint.
+
+        source -- a Snapshot, a file path, a bytes-like object (e.g. from
+            bytes(snapshot)) or a readable file object
+        """
+
+        if type(source) is Snapshot:
+            result = self.so.restore_snapshot(self.sim, source.data, source.size)
+
+        elif isinstance(source, (str, os.PathLike)):
+            result = self.so.restore(self.sim, os.fsencode(source))
+
+        else:
+            if hasattr(source, 'read'):
+                source = source.read()
+
+            data = bytes(source)
+            result = self.so.restore_snapshot(self.sim, data, len(data))
+
+        self.CheckSavable(result)
 
     def __del__(self):
-        if self.so is not None:
-            self.so.teardown()
+        if self.sim is not None:
+            self.so.destroy(self.sim)
+            self.sim = None
 
 
 @contextmanager
-def TestModule(mod_func):
+def TestModule(mod_func, opts=None, cache=None, monitors=None):
+    """Elaborate, compile and load a module for testing.
+
+    opts -- VeriOpts or a build profile name: 'fast' (no tracing or
+        save/restore, for maximum simulation speed) or 'debug' (everything)
+    cache -- None (the default) to always rebuild, a BuildCache, or True for
+        DefaultBuildCache(), which keeps libraries under $ATLAS_CACHE_DIR
+        (default ~/.cache/atlas)
+    monitors -- optional list of Monitors (e.g. MonAssert(...)) to compile in
+    """
+
     circuit = Circuit('circuit', True, True)
 
     with Context(circuit):
@@ -164,9 +825,15 @@ def TestModule(mod_func):
     circuit.top = top
     circuit.name = top.name
 
+    if cache is True:
+        cache = DefaultBuildCache()
+
     build_folder = f'test_{circuit.top.name}'
-    so_name = VeriCompile(circuit, build_folder)
+    timings = {}
+    so_name = VeriCompile(
+        circuit, build_folder, opts, cache, timings, monitors)
     tb = Testbench(circuit, so_name)
+    tb.build_timings = timings
 
     yield tb
 
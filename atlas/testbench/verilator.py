@@ -1,161 +1,831 @@
 import math
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
+from hashlib import sha256
 import subprocess
 import os
+import time
 
 from ..base import *
 from ..emitter import *
 
+from .monitor import *
+from .runtime import *
+
 vinc = '/usr/local/share/verilator/include'
+detected_vinc = None
+
+def VerilatorInclude():
+    """Return Verilator's include directory (falling back to vinc)."""
+
+    global detected_vinc
+
+    if detected_vinc is None:
+        detected_vinc = vinc
+
+        try:
+            root = subprocess.run(
+                ['verilator', '--getenv', 'VERILATOR_ROOT'],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                check=True).stdout.decode('utf-8').strip()
+
+            if os.path.isdir(os.path.join(root, 'include')):
+                detected_vinc = os.path.join(root, 'include')
+
+        except (OSError, subprocess.CalledProcessError):
+            pass
 
-verilator_cpps = [
-    f'{vinc}/verilated.cpp',
-    f'{vinc}/verilated_vcd_c.cpp',
-    f'{vinc}/verilated_save.cpp',
-]
+    return detected_vinc
 
 @dataclass(frozen=True)
 class VeriOpts(object):
+    """Options for building a Verilator simulator.
+
+    Fields:
+    output_split -- split generated C++ files at roughly this many statements
+    unroll_count -- loop unroll limit passed to verilator
+    opt_level -- optimization level for verilator and the C++ compiler
+    trace -- build with waveform tracing support
+    trace_fst -- trace to FST rather than VCD files
+    savable -- build with support for saving and restoring model state
+    threads -- number of threads the model is partitioned across
+    prof_pgo -- build an instrumented model that writes a thread scheduling
+        profile to this file when the testbench is torn down
+    pgo_profile -- a profile written by a prof_pgo build, used to schedule the
+        model's threads
+    ccache -- compile C++ through ccache
+    jobs -- number of parallel compile jobs (None for one per core)
+    """
+
     output_split : int = 12
     unroll_count : int = 1
+    opt_level : int = 3
+    trace : bool = True
+    trace_fst : bool = False
+    savable : bool = True
+    threads : int = 1
+    prof_pgo : str = None
+    pgo_profile : str = None
+    ccache : bool = False
+    jobs : int = None
+
+#
+# Named build profiles. fast drops tracing and save/restore support (both of
+# which cost simulation speed even when unused), debug builds with everything.
+#
+
+build_profiles = {
+    'fast': VeriOpts(trace=False, savable=False),
+    'debug': VeriOpts(trace=True, savable=True),
+}
+
+def VeriProfile(opts=None):
+    """Resolve opts (None, a profile name or a VeriOpts) to a VeriOpts."""
+
+    if opts is None:
+        return VeriOpts()
+
+    if type(opts) is str:
+        assert opts in build_profiles, f'Unknown build profile: {opts}'
+        return build_profiles[opts]
+
+    assert type(opts) is VeriOpts
+    return opts
 
 def BuildFlags(build_dir, top_name, opts):
-    return [
+    flags = [
         '--Mdir', f'{build_dir}',
         '--cc',
         '--lib-create', f'{top_name}',
         '--top-module', f'{top_name}',
-        '--trace',
-        '-O3',
-        '-CFLAGS', '"-O3 -fPIC"',
-        '--savable'
+        f'-O{opts.opt_level}',
+        '-CFLAGS', f'-O{opts.opt_level} -fPIC',
+        '--output-split', f'{opts.output_split}',
+        '--unroll-count', f'{opts.unroll_count}'
     ]
 
-def GenerateTestbench(circuit, clock_signal, reset_signal, filename):
+    if opts.savable:
+        flags.append('--savable')
+
+    if opts.trace:
+        flags.append('--trace-fst' if opts.trace_fst else '--trace')
+
+    if opts.threads > 1:
+        flags += ['--threads', f'{opts.threads}']
+
+    if opts.prof_pgo is not None:
+        flags.append('--prof-pgo')
+
+    if opts.pgo_profile is not None:
+        flags.append(os.path.abspath(opts.pgo_profile))
+
+    return flags
+
+def FrameFieldDecl(name, width):
+    """C declaration of an IoFrame field with the layout of Verilator's port."""
+
+    if width <= 8:
+        return f'uint8_t {name}'
+    elif width <= 16:
+        return f'uint16_t {name}'
+    elif width <= 32:
+        return f'uint32_t {name}'
+    elif width <= 64:
+        return f'uint64_t {name}'
+    else:
+        return f'uint32_t {name}[{(width + 31) // 32}]'
+
+def FrameCopy(name, to_model):
+    """C statement copying an IO between the IoFrame and the model."""
+
+    (dst, src) = (f'sim->top->{name}', f'sim->frame.{name}')
+
+    if not to_model:
+        (dst, src) = (src, dst)
+
+    return f'    memcpy(&{dst}, &{src}, sizeof(sim->frame.{name}));\n'
+
+def GenerateTestbench(
+    circuit,
+    clock_signal,
+    reset_signal,
+    filename,
+    opts=None,
+    monitors=None):
+    """Write the C++ testbench (testbench.cc) for a Verilated circuit.
+
+    The testbench exports a C API over handles: create() returns a new,
+    independent instance of the model and every other entry point takes that
+    handle (destroy() frees it). Any number of instances can exist in one
+    process and instances can be stepped from different threads concurrently.
+
+    monitors -- list of Monitors (see monitor.py) compiled into the step loop
+    """
+
     top_name = circuit.top.name
+    opts = VeriProfile(opts)
+    monitors = [] if monitors is None else monitors
+
+    #
+    # Trace support is compiled out (rather than skipped at runtime) when the
+    # model is built without --trace, so the fast profile pays nothing for it.
+    #
+
+    prof_pgo = \
+        '' if opts.prof_pgo is None else os.path.abspath(opts.prof_pgo)
+
+    symbols = ModuleSymbols(circuit.top)
+    io_bits = list(ForEachIoBits(circuit.top.io_dict))
+    io_names = [symbols.Name(bits) for bits in io_bits]
+
+    input_names = [
+        symbols.Name(bits) for bits in io_bits
+        if (symbols.Direction(bits) != M.SignalDir.OUTPUT) and
+            (symbols.Name(bits) != clock_signal)
+    ]
+
+    #
+    # Inouts are copied both ways: what Python last wrote goes into the model and
+    # whatever the design drives comes back, as if Python accessed the model's
+    # port directly.
+    #
+
+    output_names = [
+        symbols.Name(bits) for bits in io_bits
+        if symbols.Direction(bits) in { M.SignalDir.OUTPUT, M.SignalDir.INOUT }
+    ]
+
+    tb_frame_fields = ''.join([
+        f'    {FrameFieldDecl(symbols.Name(bits), bits.width)}; ' +
+        f'// {dirstr_map[symbols.Direction(bits)]}, {bits.width} bits\n'
+        for bits in io_bits
+    ])
+
+    tb_frame = f"""
+//
+// All top-level IO of the model in one contiguous struct (fields are laid out
+// with natural alignment; wide ports are arrays of 32-bit words, least
+// significant first). This is what the testbench reads and writes: inputs
+// (and inouts) are copied into the model at the start of every cycle and
+// outputs (and inouts) are copied back at the end of it. Python maps it once
+// (see Testbench.frame).
+//
+
+struct IoFrame {{
+{tb_frame_fields}}};
+"""
+
+    tb_frame_sync = f"""
+static inline void inputs_to_model(Sim * sim) {{
+{''.join(FrameCopy(name, True) for name in input_names)}}}
+
+static inline void outputs_to_frame(Sim * sim) {{
+{''.join(FrameCopy(name, False) for name in output_names)}}}
+
+static inline void model_to_frame(Sim * sim) {{
+{''.join(FrameCopy(name, False) for name in io_names)}}}
+"""
+
     tb_preamble = f"""
+#define ATLAS_TRACE {int(opts.trace)}
+#define ATLAS_TRACE_FST {int(opts.trace_fst)}
+#define ATLAS_SAVABLE {int(opts.savable)}
+#define ATLAS_THREADS {opts.threads}
+#define ATLAS_PROF_PGO "{prof_pgo}"
+#define NUM_MONITORS {len(monitors)}
+
 #include <iostream>
 #include <fstream>
 #include <queue>
 #include <string.h>
 #include <stdint.h>
+#include <vector>
 
 #include <verilated.h>
+#if ATLAS_TRACE && ATLAS_TRACE_FST
+#include <verilated_fst_c.h>
+typedef VerilatedFstC TraceFile;
+#elif ATLAS_TRACE
 #include <verilated_vcd_c.h>
+typedef VerilatedVcdC TraceFile;
+#endif
+#if ATLAS_SAVABLE
+#include <verilated_save.h>
+#endif
 
-#include "V{top_name}.h"
 #include "V{top_name}.h"
 
 #define EXPORT extern "C"
 
-uint64_t main_time = 0;
+//
+// Verilator 5 models run on the thread pool of their VerilatedContext. Each
+// instance owns its context so the pool is created with the right number of
+// threads in create() and joined in destroy().
+//
+
+#if VERILATOR_VERSION_INTEGER >= 5000000
+#define ATLAS_CONTEXT 1
+#else
+#define ATLAS_CONTEXT 0
+#endif
+
+//
+// Signal capture: every cycle, the values of sigs are recorded as one row of
+// buf, a ring of depth rows owned by the caller.
+//
+
+struct Capture {{
+    std::vector<void *> sigs;
+    std::vector<int> num_bytes;
+    uint64_t * buf;
+    uint64_t depth;
+    uint64_t pos;
+    uint64_t count;
+}};
+
+{tb_frame}
+struct Sim {{
+#if ATLAS_CONTEXT
+    VerilatedContext * contextp;
+#endif
+    V{top_name} * top;
+#if ATLAS_TRACE
+    TraceFile * tfp;
+    bool tracing;
+    uint64_t trace_start;
+    uint64_t trace_end;
+#endif
+    uint64_t main_time;
+    uint64_t cycle;
+    Capture cap;
+    IoFrame frame;
+    uint64_t mon_count[NUM_MONITORS + 1];
+    uint64_t mon_first[NUM_MONITORS + 1];
+    int32_t stop;
+    bool in_reset;
+}};
+
+//
+// Models built without a VerilatedContext read the time through
+// sc_time_stamp(). It reports the time of whichever instance the calling
+// thread is currently stepping.
+//
+
+static thread_local uint64_t cur_time = 0;
 
 double sc_time_stamp() {{
-    return main_time;
+    return cur_time;
 }}
 
-V{top_name} * top;
-VerilatedVcdC * vcd;
-"""
+//
+// Dump a trace sample (if tracing is on and the current cycle is inside the
+// trace window) and advance time.
+//
 
-    io_names = [VName(bits) for bits in ForEachIoBits(circuit.top.io_dict)]
+#if ATLAS_TRACE
+static inline void dump(Sim * sim) {{
+    if (sim->tfp && sim->tracing &&
+        sim->cycle >= sim->trace_start && sim->cycle < sim->trace_end) {{
 
-    tb_lookup_table = ''.join([
-        f'        {{"{io_name}", (void *)&top->{io_name}}},\n'
-        for io_name in io_names
+        sim->tfp->dump((vluint64_t)sim->main_time);
+    }}
+
+    sim->main_time++;
+}}
+#define DUMP(sim) dump(sim)
+#else
+#define DUMP(sim) sim->main_time++
+#endif
+"""
+
+    tb_io_table = ''.join([
+        f'    names[{i}] = "{io_name}";\n' +
+        f'    ptrs[{i}] = (void *)&sim->frame.{io_name};\n' +
+        f'    num_bytes[{i}] = sizeof(sim->frame.{io_name});\n'
+        for (i, io_name) in enumerate(io_names)
     ])
 
     tb_lookup = f"""
 #define NUM_IOS {len(io_names)}
 
-EXPORT void * lookup_io(const char * io_name) {{
-    struct {{
-        const char * name;
-        void * ptr;
-    }} lookup_table[] = {{\n{tb_lookup_table}    }};
-
-    for (int i = 0; i < NUM_IOS; i++) {{
-        const char * lut_name = lookup_table[i].name;
-        if (strncmp(io_name, lut_name, strlen(lut_name)) == 0) {{
-            // std::cout << "Lookup: " << io_name << ", " << std::hex << lookup_table[i].ptr << std::dec << std::endl;
-            return lookup_table[i].ptr;
-        }}
-    }}
+EXPORT int num_ios() {{
+    return NUM_IOS;
+}}
 
-    return NULL;
+//
+// Fill in the name, address (in the instance's IoFrame) and size (in bytes) of
+// every IO of an instance, in one call. The arrays must hold num_ios() entries.
+//
+
+EXPORT void io_table(Sim * sim, const char ** names, void ** ptrs, int * num_bytes) {{
+{tb_io_table}}}
+
+EXPORT void * io_frame(Sim * sim) {{
+    return &sim->frame;
 }}
 
+EXPORT int io_frame_size() {{
+    return sizeof(IoFrame);
+}}
+{tb_frame_sync}
 """
 
     tb_iorw = """
-EXPORT void read_io(void * signal, void * buf, int num_bytes) {
-    memcpy(buf, signal, num_bytes);
+//
+// Batch access: signal i occupies (num_bytes[i] + 7) / 8 consecutive 64-bit
+// words of buf.
+//
+
+EXPORT void read_ios(int n, void ** signals, const int * num_bytes, uint64_t * buf) {
+    for (int i = 0; i < n; i++) {
+        memcpy(buf, signals[i], num_bytes[i]);
+        buf += (num_bytes[i] + 7) / 8;
+    }
 }
 
-EXPORT void write_io(void * signal, void * buf, int num_bytes) {
-    memcpy(signal, buf, num_bytes);
+EXPORT void write_ios(int n, void ** signals, const int * num_bytes, const uint64_t * buf) {
+    for (int i = 0; i < n; i++) {
+        memcpy(signals[i], buf, num_bytes[i]);
+        buf += (num_bytes[i] + 7) / 8;
+    }
 }
 """
 
+    tb_monitors = GenerateMonitors(
+        monitors, { symbols.Name(bits): bits.width for bits in io_bits })
+
     tb_setup = f"""
-EXPORT void setup() {{
+EXPORT Sim * create() {{
+    Sim * sim = new Sim;
+    sim->main_time = 0;
+    sim->cycle = 0;
+    sim->cap.buf = NULL;
+    sim->cap.depth = 0;
+    sim->cap.pos = 0;
+    sim->cap.count = 0;
+    sim->in_reset = false;
+    clear_monitors(sim);
+
+#if ATLAS_TRACE
+    sim->tfp = NULL;
+    sim->tracing = true;
+    sim->trace_start = 0;
+    sim->trace_end = UINT64_MAX;
+#endif
+
+#if ATLAS_CONTEXT
+    sim->contextp = new VerilatedContext;
+    sim->contextp->threads(ATLAS_THREADS);
+    if (ATLAS_PROF_PGO[0]) sim->contextp->profVltFilename(ATLAS_PROF_PGO);
+#if ATLAS_TRACE
+    sim->contextp->traceEverOn(true);
+#endif
+    sim->top = new V{top_name}(sim->contextp);
+#else
+#if ATLAS_TRACE
     Verilated::traceEverOn(true);
+#endif
+    sim->top = new V{top_name};
+#endif
 
-    top = new V{top_name};
-    vcd = NULL;
+    model_to_frame(sim);
+    return sim;
 }}
 
-EXPORT void setup_vcd(char * filename) {{
-    vcd = new VerilatedVcdC;
-    top->trace(vcd, 99);
-    vcd->open(filename);
+//
+// Open a trace file, closing any previous one. levels limits the hierarchy
+// depth traced and, if n_scopes > 0, only the given scopes (hierarchical
+// names, e.g. "TOP.foo") and everything below them down to levels are traced.
+// Returns -1 if the model was built without tracing.
+//
+
+EXPORT int open_trace(
+    Sim * sim,
+    const char * filename,
+    int levels,
+    const char ** scopes,
+    int n_scopes)
+{{
+#if ATLAS_TRACE
+    if (sim->tfp != NULL) {{
+        sim->tfp->close();
+        delete sim->tfp;
+    }}
+
+    sim->tfp = new TraceFile;
+
+    for (int i = 0; i < n_scopes; i++) {{
+        sim->tfp->dumpvars(levels, scopes[i]);
+    }}
+
+    sim->top->trace(sim->tfp, levels);
+    sim->tfp->open(filename);
+    return 0;
+#else
+    return -1;
+#endif
+}}
+
+EXPORT void close_trace(Sim * sim) {{
+#if ATLAS_TRACE
+    if (sim->tfp != NULL) {{
+        sim->tfp->close();
+        delete sim->tfp;
+        sim->tfp = NULL;
+    }}
+#endif
+}}
+
+EXPORT void trace_on(Sim * sim, int on) {{
+#if ATLAS_TRACE
+    sim->tracing = on != 0;
+#endif
+}}
+
+//
+// Only dump cycles in [start, end).
+//
+
+EXPORT void trace_window(Sim * sim, uint64_t start, uint64_t end) {{
+#if ATLAS_TRACE
+    sim->trace_start = start;
+    sim->trace_end = end;
+#endif
+}}
+
+EXPORT uint64_t cycle(Sim * sim) {{
+    return sim->cycle;
+}}
+
+//
+// Start capturing n signals (each at most 64 bits) into buf, a ring of depth
+// rows of n words, sampled after every cycle. depth == 0 stops capturing.
+//
+
+EXPORT void capture(
+    Sim * sim,
+    int n,
+    void ** sigs,
+    const int * num_bytes,
+    uint64_t * buf,
+    uint64_t depth)
+{{
+    Capture & cap = sim->cap;
+
+    cap.sigs.assign(sigs, sigs + n);
+    cap.num_bytes.assign(num_bytes, num_bytes + n);
+    cap.buf = buf;
+    cap.depth = n > 0 ? depth : 0;
+    cap.pos = 0;
+    cap.count = 0;
+}}
+
+EXPORT uint64_t capture_count(Sim * sim) {{
+    return sim->cap.count;
 }}
 """
 
     tb_reset = f"""
-EXPORT void reset(int num_cycles) {{
-    top->{reset_signal} = 1;
+static inline void record(Capture & cap) {{
+    uint64_t * row = cap.buf + cap.pos * cap.sigs.size();
 
-    for (int i = 0; i < num_cycles; i++) {{
-        top->{clock_signal} = 0;
+    for (size_t i = 0; i < cap.sigs.size(); i++) {{
+        uint64_t val = 0;
+        memcpy(&val, cap.sigs[i], cap.num_bytes[i]);
+        row[i] = val;
+    }}
+
+    if (++cap.pos == cap.depth) cap.pos = 0;
+    cap.count++;
+}}
+
+static inline void tick(Sim * sim) {{
+    V{top_name} * top = sim->top;
+
+    inputs_to_model(sim);
+
+    cur_time = sim->main_time;
+    top->{clock_signal} = 0;
 
-        top->eval();
-        if (vcd) vcd->dump((vluint64_t)main_time++);
+    top->eval();
+    DUMP(sim);
 
-        top->{clock_signal} = 1;
+    cur_time = sim->main_time;
+    top->{clock_signal} = 1;
 
-        top->eval();
-        if (vcd) vcd->dump((vluint64_t)main_time++);
+    top->eval();
+    DUMP(sim);
+
+    outputs_to_frame(sim);
+
+    if (sim->cap.depth) record(sim->cap);
+    sim->cycle++;
+
+    if (!sim->in_reset) check_monitors(sim);
+}}
+
+EXPORT void reset(Sim * sim, int num_cycles) {{
+    sim->frame.{reset_signal} = 1;
+    sim->in_reset = true;
+
+    for (int i = 0; i < num_cycles; i++) {{
+        tick(sim);
     }}
 
-    top->io_reset = 0;
+    sim->frame.{reset_signal} = 0;
+    sim->in_reset = false;
 }}
 """
 
     tb_step = f"""
-EXPORT void step(int num_cycles) {{
-    for (int i = 0; i < num_cycles; i++) {{
-        top->{clock_signal} = 0;
+//
+// The stepping functions below return early if a monitor stops the
+// simulation (sim->stop). step and run return the number of cycles run.
+//
+
+EXPORT int64_t step(Sim * sim, int64_t num_cycles) {{
+    for (int64_t i = 0; i < num_cycles; i++) {{
+        tick(sim);
+        if (sim->stop) return i + 1;
+    }}
+
+    return num_cycles;
+}}
+
+//
+// Step until (signal & mask) == value, checking before every cycle. Only the
+// low 64 bits of wider signals are compared. Returns the number of cycles
+// stepped or -1 if the condition did not hold within max_cycles (or the
+// number of cycles stepped if a monitor stopped the simulation).
+//
 
-        top->eval();
-        if (vcd) vcd->dump((vluint64_t)main_time++);
+EXPORT int64_t step_until(
+    Sim * sim,
+    void * signal,
+    int num_bytes,
+    uint64_t value,
+    uint64_t mask,
+    int64_t max_cycles)
+{{
+    if (num_bytes > 8) num_bytes = 8;
 
-        top->{clock_signal} = 1;
+    for (int64_t i = 0; i <= max_cycles; i++) {{
+        uint64_t cur = 0;
+        memcpy(&cur, signal, num_bytes);
+        if ((cur & mask) == value) return i;
 
-        top->eval();
-        if (vcd) vcd->dump((vluint64_t)main_time++);
+        if (i < max_cycles) {{
+            tick(sim);
+            if (sim->stop) return i + 1;
+        }}
     }}
+
+    return -1;
+}}
+
+//
+// Streamed execution: for each cycle c, write in_cols[i][c] (masked to
+// in_masks[i]) to every input, step one cycle and sample every output into
+// out_cols[j][c]. Signals are at most 64 bits wide.
+//
+
+EXPORT int64_t run(
+    Sim * sim,
+    int64_t num_cycles,
+    int n_in,
+    void ** in_sigs,
+    const int * in_bytes,
+    const uint64_t * in_masks,
+    const uint64_t ** in_cols,
+    int n_out,
+    void ** out_sigs,
+    const int * out_bytes,
+    uint64_t ** out_cols)
+{{
+    for (int64_t c = 0; c < num_cycles; c++) {{
+        for (int i = 0; i < n_in; i++) {{
+            uint64_t val = in_cols[i][c] & in_masks[i];
+            memcpy(in_sigs[i], &val, in_bytes[i]);
+        }}
+
+        tick(sim);
+
+        for (int j = 0; j < n_out; j++) {{
+            uint64_t val = 0;
+            memcpy(&val, out_sigs[j], out_bytes[j]);
+            out_cols[j][c] = val;
+        }}
+
+        if (sim->stop) return c + 1;
+    }}
+
+    return num_cycles;
 }}
+"""
+
+    tb_save = """
+//
+// Checkpointing (models built with --savable only). A checkpoint holds the
+// model state, the IoFrame, the simulation time and the cycle count, either in a file or in memory (a
+// Snapshot). All entry points return -1 if the model is not savable.
+//
+
+struct Snapshot {
+    std::vector<uint8_t> data;
+};
+
+#if ATLAS_SAVABLE
+
+class SnapshotSave : public VerilatedSerialize {
+public:
+    Snapshot * snap;
+
+    SnapshotSave(Snapshot * snap) : snap(snap) {
+        m_isOpen = true;
+        header();
+    }
+
+    ~SnapshotSave() override { close(); }
+
+    void close() override {
+        if (!m_isOpen) return;
+        trailer();
+        flush();
+        m_isOpen = false;
+    }
+
+    void flush() override {
+        snap->data.insert(snap->data.end(), m_bufp, m_cp);
+        m_cp = m_bufp;
+    }
+};
+
+class SnapshotRestore : public VerilatedDeserialize {
+public:
+    const uint8_t * src;
+    size_t remaining;
+
+    SnapshotRestore(const uint8_t * data, size_t size) : src(data), remaining(size) {
+        m_isOpen = true;
+        m_cp = m_bufp;
+        m_endp = m_bufp;
+        header();
+    }
+
+    ~SnapshotRestore() override { close(); }
+
+    void close() override {
+        if (!m_isOpen) return;
+        trailer();
+        m_isOpen = false;
+    }
+
+    void fill() override {
+        uint8_t * rp = m_bufp;
+        for (uint8_t * sp = m_cp; sp < m_endp; *rp++ = *sp++) {}
+        m_endp = m_bufp + (m_endp - m_cp);
+        m_cp = m_bufp;
+
+        size_t n = m_bufp + bufferSize() - m_endp;
+        if (n > remaining) n = remaining;
+
+        memcpy(m_endp, src, n);
+        src += n;
+        remaining -= n;
+        m_endp += n;
+    }
+};
+
+#endif
+
+EXPORT int save(Sim * sim, const char * filename) {
+#if ATLAS_SAVABLE
+    VerilatedSave os;
+    os.open(filename);
+    if (!os.isOpen()) return -1;
+    os << sim->main_time;
+    os << sim->cycle;
+    os.write(&sim->frame, sizeof(IoFrame));
+    os << *sim->top;
+    os.close();
+    return 0;
+#else
+    return -1;
+#endif
+}
+
+EXPORT int restore(Sim * sim, const char * filename) {
+#if ATLAS_SAVABLE
+    VerilatedRestore is;
+    is.open(filename);
+    if (!is.isOpen()) return -1;
+    is >> sim->main_time;
+    is >> sim->cycle;
+    is.read(&sim->frame, sizeof(IoFrame));
+    is >> *sim->top;
+    is.close();
+    return 0;
+#else
+    return -1;
+#endif
+}
+
+EXPORT Snapshot * snapshot(Sim * sim) {
+#if ATLAS_SAVABLE
+    Snapshot * snap = new Snapshot;
+    SnapshotSave os(snap);
+    os << sim->main_time;
+    os << sim->cycle;
+    os.write(&sim->frame, sizeof(IoFrame));
+    os << *sim->top;
+    os.close();
+    return snap;
+#else
+    return NULL;
+#endif
+}
+
+EXPORT int restore_snapshot(Sim * sim, const uint8_t * data, size_t size) {
+#if ATLAS_SAVABLE
+    SnapshotRestore is(data, size);
+    is >> sim->main_time;
+    is >> sim->cycle;
+    is.read(&sim->frame, sizeof(IoFrame));
+    is >> *sim->top;
+    is.close();
+    return 0;
+#else
+    return -1;
+#endif
+}
+
+EXPORT const uint8_t * snapshot_data(Snapshot * snap) {
+    return snap->data.data();
+}
+
+EXPORT size_t snapshot_size(Snapshot * snap) {
+    return snap->data.size();
+}
+
+EXPORT void free_snapshot(Snapshot * snap) {
+    delete snap;
+}
 """
 
     tb_teardown = f"""
-EXPORT void teardown() {{
-    if (vcd != NULL) vcd->close();
-    top->final();
+EXPORT void destroy(Sim * sim) {{
+    close_trace(sim);
+
+    sim->top->final();
+    delete sim->top;
+
+#if ATLAS_CONTEXT
+    delete sim->contextp;
+#endif
 
-    delete vcd;
-    delete top;
+    delete sim;
 }}
 """
 
@@ -163,51 +833,216 @@ EXPORT void teardown() {{
         f.write(tb_preamble)
         f.write(tb_lookup)
         f.write(tb_iorw)
+        f.write(tb_monitors)
         f.write(tb_setup)
         f.write(tb_reset)
         f.write(tb_step)
+        f.write(tb_save)
         f.write(tb_teardown)
 
 
-def VeriCompile(circuit, build_dir):
+toolchain_versions = None
+
+def ToolchainVersions():
+    """Return the version strings of verilator and g++ (cached)."""
+
+    global toolchain_versions
+
+    if toolchain_versions is None:
+        versions = []
+
+        for tool in ['verilator', 'g++']:
+            try:
+                versions.append(subprocess.run(
+                    [tool, '--version'],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL,
+                    check=False).stdout.decode('utf-8').strip())
+            except OSError:
+                versions.append('')
+
+        toolchain_versions = tuple(versions)
+
+    return toolchain_versions
+
+def BuildKey(vfilename, testbench_name, flags, opts):
+    """Digest of everything that determines the compiled simulator."""
+
+    h = sha256()
+    filenames = [vfilename, testbench_name]
+
+    if opts.pgo_profile is not None:
+        filenames.append(opts.pgo_profile)
+
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            h.update(f.read())
+
+    #
+    # The number of jobs and use of ccache do not change what gets built.
+    #
+
+    opts = replace(opts, jobs=None, ccache=False)
+
+    h.update(repr((flags, opts, ToolchainVersions())).encode('utf-8'))
+    return h.hexdigest()
+
+@contextmanager
+def TimeStage(timings, stage):
+    start = time.perf_counter()
+    yield
+    timings[stage] = time.perf_counter() - start
+
+def VeriCompile(
+    circuit,
+    build_dir,
+    opts=None,
+    cache=None,
+    timings=None,
+    monitors=None):
+    """Build a simulator library for circuit and return its path.
+
+    opts -- VeriOpts or build profile name ('fast' or 'debug') to build with
+    cache -- optional BuildCache. If the emitted Verilog, generated testbench,
+        options and toolchain all match a previous build, the cached library is
+        returned without invoking verilator or g++.
+    timings -- optional dict that is filled with the wall time (in seconds) of
+        each build stage
+    monitors -- optional list of Monitors to compile into the testbench
+
+    After verilator has generated the model, make (which compiles the model),
+    compilation of testbench.cc and (with a cache) of the shared runtime all
+    run concurrently. Any failing stage raises CalledProcessError.
+    """
+
     top_name = circuit.top.name
-    opts = VeriOpts()
+
+    opts = VeriProfile(opts)
+
+    if timings is None:
+        timings = {}
+
+    jobs = opts.jobs if opts.jobs is not None else os.cpu_count()
+    cxx = ['ccache', 'g++'] if opts.ccache else ['g++']
+    include = VerilatorInclude()
+
     flags = BuildFlags(build_dir, top_name, opts)
     vfilename = f'{build_dir}/circuit.v'
 
     if not os.path.exists(build_dir):
         os.mkdir(build_dir)
 
-    EmitCircuit(circuit, vfilename)
+    with TimeStage(timings, 'emit'):
+        EmitCircuit(circuit, vfilename, incremental=True)
 
-    cmdline = ['verilator'] + flags + [vfilename]
-    veri_proc = subprocess.Popen(' '.join(cmdline), shell=True)
-    veri_proc.wait()
+    testbench_name = f'{build_dir}/testbench.cc'
 
-    makefile_name = f'V{top_name}.mk'
-    make_proc = subprocess.Popen(['make', '-j4', '-C', build_dir, '-f', makefile_name])
-    make_proc.wait()
+    with TimeStage(timings, 'generate_testbench'):
+        GenerateTestbench(
+            circuit, 'io_clock', 'io_reset', testbench_name, opts, monitors)
 
-    testbench_name = f'{build_dir}/testbench.cc'
-    GenerateTestbench(circuit, 'io_clock', 'io_reset', testbench_name)
+    if cache is not None:
+        key = BuildKey(vfilename, testbench_name, flags, opts)
+        cached_so_name = cache.Lookup(key)
 
-    vlib_name = f'{build_dir}/lib{top_name}.a'
-    so_name = f'./{build_dir}/verisim.so'
+        if cached_so_name is not None:
+            return cached_so_name
+
+    with TimeStage(timings, 'verilator'):
+        subprocess.run(['verilator'] + flags + [vfilename], check=True)
+
+    make_vars = ParseMakeVars(f'{build_dir}/V{top_name}_classes.mk')
+    verilator_version = ToolchainVersions()[0]
+    defines = RuntimeDefines(make_vars, verilator_version)
+
+    #
+    # With a build cache, the Verilator runtime is compiled once per
+    # configuration into a shared archive, and make is told not to build its
+    # own copy (by emptying the runtime source lists).
+    #
+
+    make_cmdline = [
+        'make',
+        f'-j{jobs}',
+        '-C', build_dir,
+        '-f', f'V{top_name}.mk'
+    ]
+
+    if opts.ccache:
+        make_cmdline.append('OBJCACHE=ccache')
 
-    cmdline = [
-        'g++',
-        '-shared',
+    if cache is not None:
+        make_cmdline += ['VM_GLOBAL_FAST=', 'VM_GLOBAL_SLOW=']
+
+    testbench_obj = f'{build_dir}/testbench.o'
+
+    testbench_cmdline = cxx + [
+        f'-O{opts.opt_level}',
         '-fPIC',
-        f'-o{so_name}',
-        testbench_name,
-        '-I', vinc,
-        '-L', f'./{build_dir}',
-        f'./{build_dir}/lib{top_name}.so'
+        '-I', build_dir,
+        '-I', include,
+        '-I', f'{include}/vltstd'
+    ] + defines + [
+        '-c', testbench_name,
+        '-o', testbench_obj
     ]
-    print(' '.join(cmdline))
 
-    gpp_proc = subprocess.Popen(cmdline)
+    def Make():
+        with TimeStage(timings, 'make'):
+            subprocess.run(make_cmdline, check=True)
+
+    def CompileTestbench():
+        with TimeStage(timings, 'compile_testbench'):
+            subprocess.run(testbench_cmdline, check=True)
+
+    def BuildRuntime():
+        with TimeStage(timings, 'runtime'):
+            return RuntimeArchive(
+                cache.path,
+                include,
+                RuntimeSources(
+                    make_vars, opts.trace, opts.trace_fst, opts.savable),
+                [f'-O{opts.opt_level}', '-fPIC'] + defines,
+                verilator_version,
+                jobs,
+                cxx)
+
+    with TimeStage(timings, 'compile'):
+        with ThreadPoolExecutor(3) as pool:
+            make_future = pool.submit(Make)
+            testbench_future = pool.submit(CompileTestbench)
+
+            if cache is not None:
+                runtime_libs = [pool.submit(BuildRuntime).result()]
+            else:
+                runtime_libs = []
+
+            make_future.result()
+            testbench_future.result()
+
+    vlib_name = f'{build_dir}/lib{top_name}.a'
+    so_name = f'./{build_dir}/verisim.so'
+    sys_libs = ['-lz'] if opts.trace and opts.trace_fst else []
+
+    #
+    # Link the model statically so the resulting library does not depend on
+    # anything in the build directory (which may be deleted or reused).
+    #
+
+    with TimeStage(timings, 'link'):
+        subprocess.run(
+            cxx + [
+                '-shared',
+                '-fPIC',
+                f'-o{so_name}',
+                testbench_obj,
+                vlib_name
+            ] + runtime_libs + sys_libs + [
+                '-pthread'
+            ],
+            check=True)
 
-    gpp_proc.wait()
+    if cache is not None:
+        return cache.Store(key, so_name)
 
-    return so_name
\ No newline at end of file
+    return so_name
@@ -0,0 +1,52 @@
+import sys
+sys.path.append('.')
+
+from atlas import *
+
+#
+# Emits combinational logic in M.CombStyle.ALWAYS mode: predicated signals are
+# driven from always @* blocks (and declared reg), except the inout port which
+# keeps a continuous assignment.
+#
+
+@Module
+def PriorityBus(n=8):
+    io = Io({
+        'a': Input(Bits(n)),
+        'b': Input(Bits(n)),
+        'sel_a': Input(Bits(1)),
+        'sel_b': Input(Bits(1)),
+        'drive': Input(Bits(1)),
+        'out': Output(Bits(n)),
+        'valid': Output(Bits(1)),
+        'bus': Inout(Bits(n))
+    })
+
+    picked = Wire(Bits(n))
+
+    picked <<= 0
+
+    with io.sel_a:
+        picked <<= io.a
+    with otherwise:
+        with io.sel_b:
+            picked <<= io.b
+
+    io.out <<= picked
+
+    io.valid <<= 0
+    with io.sel_a | io.sel_b:
+        io.valid <<= 1
+
+    io.bus <<= 0
+    with io.drive:
+        io.bus <<= picked
+
+    NameSignals(locals())
+
+circuit = Circuit('combalways', comb_style=M.CombStyle.ALWAYS)
+
+with Context(circuit):
+    circuit.top = PriorityBus()
+
+EmitCircuit(circuit, 'tests/combalways.v')
@@ -0,0 +1,127 @@
+import sys
+sys.path.append('.')
+
+import time
+
+from atlas import *
+
+#
+# Benchmark of connection tree construction for N sequential and N nested
+# conditional assignments. LegacyBuildConnectionTree is the original
+# implementation that rebuilt connections[:-1] on every path, kept here only as
+# a reference point.
+#
+
+def LegacyBuildConnectionTree(connections):
+    if len(connections) == 0:
+        return None
+
+    if type(connections[-1]) is not M.ConnectionBlock:
+        return connections[-1]
+
+    if (len(connections[-1].true_block) > 0) and \
+        (len(connections[-1].false_block) > 0):
+
+        return M.ConnectionTree(
+            predicate=connections[-1].predicate,
+            true_path=LegacyBuildConnectionTree(
+                connections[:-1] + connections[-1].true_block),
+            false_path=LegacyBuildConnectionTree(
+                connections[:-1] + connections[-1].false_block))
+
+    sub_ctree = LegacyBuildConnectionTree(connections[:-1])
+
+    if len(connections[-1].true_block) > 0:
+        return M.ConnectionTree(
+            predicate=connections[-1].predicate,
+            true_path=LegacyBuildConnectionTree(
+                connections[:-1] + connections[-1].true_block),
+            false_path=sub_ctree)
+
+    return M.ConnectionTree(
+        predicate=connections[-1].predicate,
+        true_path=sub_ctree,
+        false_path=LegacyBuildConnectionTree(
+            connections[:-1] + connections[-1].false_block))
+
+def CountNodes(ctree):
+    seen = set()
+    stack = [ctree]
+
+    while len(stack) > 0:
+        node = stack.pop()
+        if (type(node) is M.ConnectionTree) and (id(node) not in seen):
+            seen.add(id(node))
+            stack += [node.true_path, node.false_path]
+
+    return len(seen)
+
+@Module
+def Sequential(n):
+    """N FSM-style blocks in a row, each with a nested condition."""
+
+    io = Io({
+        'state': Input(Bits(16)),
+        'go': Input(Bits(1)),
+        'out': Output(Bits(16))
+    })
+
+    io.out <<= 0
+
+    for i in range(n):
+        with io.state == i:
+            with io.go:
+                io.out <<= i
+
+    NameSignals(locals())
+
+@Module
+def Nested(n):
+    """N conditions nested inside each other."""
+
+    io = Io({
+        'conds': Input([Bits(1) for _ in range(n)]),
+        'out': Output(Bits(16))
+    })
+
+    io.out <<= 0
+
+    def Nest(i):
+        if i == n:
+            return
+
+        with io.conds[i]:
+            io.out <<= i
+            Nest(i + 1)
+
+    Nest(0)
+
+    NameSignals(locals())
+
+def Time(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def Bench(label, gen, sizes, legacy_max):
+    circuit = Circuit(label)
+
+    with Context(circuit):
+        tops = [gen(n) for n in sizes]
+
+    for (n, top) in zip(sizes, tops):
+        connections = top.io_dict['out'].connections
+
+        ctree, t_new = Time(BuildConnectionTree, connections)
+        line = f'{label:>10} n={n:<6} new: {t_new * 1e3:9.3f} ms ' + \
+            f'({CountNodes(ctree)} nodes)'
+
+        if n <= legacy_max:
+            legacy, t_old = Time(LegacyBuildConnectionTree, connections)
+            line += f'  legacy: {t_old * 1e3:9.3f} ms ' + \
+                f'({CountNodes(legacy)} nodes)'
+
+        print(line)
+
+Bench('sequential', Sequential, [4, 8, 12, 16, 1000, 10000], 16)
+Bench('nested', Nested, [4, 16, 64, 256, 512], 512)
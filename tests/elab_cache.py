@@ -0,0 +1,120 @@
+import sys
+sys.path.append('.')
+
+import io
+import tempfile
+
+from atlas import *
+
+#
+# Checks the on-disk elaboration cache: a second elaboration of the same design
+# is reloaded from disk and emits identical Verilog, and changing the circuit's
+# default clock / reset settings or the values a factory-made generator closes
+# over does not reuse the cached modules.
+#
+
+@Module
+def FullAdder():
+    io = Io({
+        'a': Input(Bits(1)),
+        'b': Input(Bits(1)),
+        'cin': Input(Bits(1)),
+        'sum_out': Output(Bits(1)),
+        'cout': Output(Bits(1))
+    })
+
+    a_xor_b = io.a ^ io.b
+    io.sum_out <<= a_xor_b ^ io.cin
+    io.cout <<= (io.a & io.b) | (a_xor_b & io.cin)
+
+    NameSignals(locals())
+
+@Module
+def RippleAdder(n):
+    io = Io({
+        'a': Input(Bits(n)),
+        'b': Input(Bits(n)),
+        'cin': Input(Bits(1)),
+        'sum_out': Output(Bits(n)),
+        'cout': Output(Bits(1))
+    })
+
+    carry = Wire([Bits(1) for i in range(n + 1)])
+    out_arr = Wire([Bits(1) for i in range(n)])
+
+    carry[0] <<= io.cin
+
+    for i in range(n):
+        fa = Instance(FullAdder())
+        fa.cin <<= carry[i]
+        fa.a <<= io.a(i, i)
+        fa.b <<= io.b(i, i)
+        carry[i + 1] <<= fa.cout
+        out_arr[i] <<= fa.sum_out
+
+    io.cout <<= carry[n]
+    io.sum_out <<= Cat([out_arr[n - i - 1] for i in range(n)])
+
+    NameSignals(locals())
+
+def MakeConst(value):
+    @Module
+    def Const():
+        io = Io({
+            'o': Output(Bits(8))
+        })
+
+        io.o <<= value
+
+    return Const
+
+def Elaborate(cache, default_clock, default_reset):
+    circuit = Circuit('adder', default_clock, default_reset)
+
+    with Context(circuit, cache):
+        circuit.top = RippleAdder(4)
+
+    f = io.StringIO()
+    EmitCircuitTo(circuit, VWriter(f))
+    return circuit, f.getvalue()
+
+def Ports(module):
+    return sorted(module.io_dict.keys())
+
+with tempfile.TemporaryDirectory() as cache_dir:
+    cache = ElaborationCache(cache_dir)
+
+    (_, first) = Elaborate(cache, True, True)
+    assert (cache.hits, cache.stores) == (0, 2), cache
+
+    (circuit, second) = Elaborate(cache, True, True)
+    assert cache.hits == 2, cache
+    assert second == first
+    assert 'clock' in Ports(circuit.top)
+
+    (circuit, third) = Elaborate(cache, False, False)
+    assert cache.hits == 2, cache
+    assert Ports(circuit.top) == ['a', 'b', 'cin', 'cout', 'sum_out']
+    assert third != first
+
+    def ElaborateConst(value):
+        circuit = Circuit('const')
+        const_cache = ElaborationCache(cache_dir)
+
+        with Context(circuit, const_cache):
+            circuit.top = MakeConst(value)()
+
+        f = io.StringIO()
+        EmitCircuitTo(circuit, VWriter(f))
+        return const_cache.hits, f.getvalue()
+
+    (hits, text) = ElaborateConst(4)
+    assert (hits, 'assign io_o = 4;' in text) == (0, True)
+
+    (hits, text) = ElaborateConst(9)
+    assert (hits, 'assign io_o = 9;' in text) == (0, True), text
+
+    (hits, text) = ElaborateConst(4)
+    assert (hits, 'assign io_o = 4;' in text) == (1, True)
+
+    print(cache)
@@ -0,0 +1,97 @@
+import sys
+sys.path.append('.')
+
+import io
+import os
+import tempfile
+
+from atlas import *
+
+#
+# Checks split emission (one file per module) with several worker processes:
+# the module files add up to the single-file output, re-emitting an unchanged
+# circuit touches no files, and a changed circuit only rewrites what changed
+# and removes files of modules that are gone.
+#
+
+@Module
+def Counter(width):
+    io = Io({
+        'en': Input(Bits(1)),
+        'count': Output(Bits(width))
+    })
+
+    count = Reg(Bits(width), reset_value=0)
+
+    with io.en:
+        count <<= count + 1
+
+    io.count <<= count
+
+    NameSignals(locals())
+
+@Module
+def Counters(widths):
+    io = Io({
+        'en': Input(Bits(1)),
+        'parity': Output(Bits(1))
+    })
+
+    parity = 0
+
+    for width in widths:
+        counter = Instance(Counter(width))
+        counter.en <<= io.en
+        parity = counter.count(0, 0) ^ parity
+
+    io.parity <<= parity
+
+    NameSignals(locals())
+
+def Elaborate(widths):
+    circuit = Circuit('counters', True, True)
+
+    with Context(circuit):
+        circuit.top = Counters(widths)
+
+    return circuit
+
+def Mtimes(dirname):
+    return {
+        name: os.stat(os.path.join(dirname, name)).st_mtime_ns
+        for name in os.listdir(dirname)
+    }
+
+with tempfile.TemporaryDirectory() as dirname:
+    circuit = Elaborate([4, 8, 12, 16])
+    stats = EmitCircuitFiles(circuit, dirname, jobs=4)
+
+    assert len(stats) == 5
+    assert all(s.rewritten for s in stats.values())
+
+    f = io.StringIO()
+    EmitCircuitTo(circuit, VWriter(f))
+
+    split_text = ''
+    for module in circuit.modules:
+        with open(os.path.join(dirname, f'{module.name}.v')) as mf:
+            split_text += mf.read()
+
+    assert split_text == f.getvalue()
+
+    mtimes = Mtimes(dirname)
+    stats = EmitCircuitFiles(Elaborate([4, 8, 12, 16]), dirname, jobs=4)
+
+    assert not any(s.rewritten for s in stats.values())
+    assert Mtimes(dirname) == mtimes
+
+    circuit = Elaborate([4, 8, 12])
+    stats = EmitCircuitFiles(circuit, dirname, jobs=4)
+    rewritten = [name for (name, s) in stats.items() if s.rewritten]
+
+    assert rewritten == [circuit.top.name], rewritten
+    assert sorted(os.listdir(dirname)) == sorted(
+        [f'{module.name}.v' for module in circuit.modules] +
+        ['counters.f', 'counters.manifest.json'])
+
+    print(f'{len(circuit.modules)} modules, rewritten: {rewritten}')
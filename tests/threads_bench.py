@@ -0,0 +1,85 @@
+import sys
+sys.path.append('.')
+
+import time
+
+from atlas import *
+
+#
+# Benchmark of simulation speed (cycles / sec) against the number of threads
+# the Verilator model is partitioned across. The design is a set of independent
+# multiply-xor pipelines, which gives Verilator plenty of parallel work.
+#
+# Usage: python tests/threads_bench.py [lanes] [depth] [cycles]
+#
+
+@Module
+def Lane(width, depth, lane_id):
+    io = Io({
+        'seed': Input(Bits(width)),
+        'out': Output(Bits(width))
+    })
+
+    stages = [Reg(Bits(width)) for _ in range(depth)]
+    stages[0] <<= io.seed ^ stages[depth - 1]
+
+    for i in range(1, depth):
+        product = stages[i - 1] * (2 * lane_id + 2 * i + 1)
+        stages[i] <<= product(width - 1, 0) ^ stages[i - 1]
+
+    io.out <<= stages[depth - 1]
+
+    NameSignals(locals())
+
+@Module
+def Mixer(width, lanes, depth):
+    io = Io({
+        'seed': Input(Bits(width)),
+        'out': Output(Bits(width))
+    })
+
+    outs = Wire([Bits(width) for _ in range(lanes)])
+
+    for i in range(lanes):
+        lane = Instance(Lane(width, depth, i))
+        lane.seed <<= io.seed
+        outs[i] <<= lane.out
+
+    result = outs[0]
+
+    for i in range(1, lanes):
+        result = result ^ outs[i]
+
+    io.out <<= result
+
+    NameSignals(locals())
+
+def Bench(lanes, depth, cycles, threads):
+    opts = VeriOpts(trace=False, savable=False, threads=threads)
+
+    with TestModule(lambda: Mixer(64, lanes, depth), opts) as tb:
+        tb.io.seed <<= 0x123456789
+        tb.Reset(1)
+
+        start = time.perf_counter()
+        tb.Step(cycles)
+        elapsed = time.perf_counter() - start
+
+        #
+        # make, compile_testbench and runtime run concurrently inside the
+        # compile stage, so only the top-level stages add up to the build time.
+        #
+
+        build = sum(
+            seconds for (stage, seconds) in tb.build_timings.items()
+            if stage not in { 'make', 'compile_testbench', 'runtime' })
+        print(
+            f'threads={threads:<3} {cycles / elapsed:12.0f} cycles/sec ' +
+            f'(build: {build:.1f} s)')
+
+lanes = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+depth = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+cycles = int(sys.argv[3]) if len(sys.argv) > 3 else 100000
+
+for threads in [1, 2, 4, 8]:
+    Bench(lanes, depth, cycles, threads)
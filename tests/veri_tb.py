@@ -1,6 +1,11 @@
 import sys
 sys.path.append('.')
 
+import os
+import tempfile
+
+import numpy as np
+
 from atlas import *
 
 @Module
@@ -33,7 +38,7 @@ def Gcd(data_width):
     NameSignals(locals())
 
 
-def HwGcd(tb, a, b):
+def StartGcd(tb, a, b):
     tb.Reset(10)
     tb.io.in_a <<= a
     tb.io.in_b <<= b
@@ -41,8 +46,9 @@ def HwGcd(tb, a, b):
     tb.Step(1)
     tb.io.start <<= 0
 
-    while tb.io.done.GetValue() == 0:
-        tb.Step(1)
+def HwGcd(tb, a, b):
+    StartGcd(tb, a, b)
+    tb.StepUntil(tb.io.done, 1)
 
     return tb.io.out.GetValue()
 
@@ -52,11 +58,171 @@ def SwGcd(a, b):
 
     return a
 
-with TestModule(lambda: Gcd(64)) as tb:
-    for i in range(2, 100):
-        for j in range(2, 100):
-            s = SwGcd(i, j)
-            h = HwGcd(tb, i, j)
-            if s >= 10:
-                print(s, '==', h)
-            assert s == h, f'Mismatch for Gcd({i}, {j})!'
\ No newline at end of file
+def GcdCase(tb, case):
+    (a, b) = case
+    s = SwGcd(a, b)
+    h = HwGcd(tb, a, b)
+    assert s == h, f'Mismatch for Gcd({a}, {b})!'
+    return h
+
+def CheckGroup(tb):
+    group = tb.Group([tb.io.in_a, tb.io.in_b, tb.io.start])
+
+    group.Poke([12, 18, 1])
+    assert group.Peek() == (12, 18, 1)
+    assert tb.io.in_b.GetValue() == 18
+
+    group.Poke(np.array([7, 9, 3], dtype=np.uint64))
+    assert group.Peek() == (7, 9, 1), 'start should be masked to 1 bit'
+
+    tb.io.start <<= 0
+
+def CheckRun(tb):
+    num_cycles = 200
+    rng = np.random.default_rng(0)
+    in_a = rng.integers(1, 1000, num_cycles, dtype=np.uint64)
+    in_b = rng.integers(1, 1000, num_cycles, dtype=np.uint64)
+    start = (np.arange(num_cycles) % 20 == 0).astype(np.uint64)
+
+    #
+    # Stimulus starts with start = 1, so the registers are loaded in the
+    # first cycle and both runs see the same state from then on.
+    #
+
+    tb.Reset(10)
+    loop_out = []
+
+    for c in range(num_cycles):
+        tb.io.in_a <<= int(in_a[c])
+        tb.io.in_b <<= int(in_b[c])
+        tb.io.start <<= int(start[c])
+        tb.Step(1)
+        loop_out.append((tb.io.out.GetValue(), tb.io.done.GetValue()))
+
+    tb.Reset(10)
+    out = np.zeros(num_cycles, dtype=np.uint64)
+    done = np.zeros(num_cycles, dtype=np.uint64)
+
+    tb.Run(
+        { tb.io.in_a: in_a, tb.io.in_b: in_b, tb.io.start: start },
+        { tb.io.out: out, tb.io.done: done })
+
+    assert list(zip(out.tolist(), done.tolist())) == loop_out
+    tb.io.start <<= 0
+
+def CheckReplay(tb):
+    def Trace(num_cycles):
+        values = []
+        for _ in range(num_cycles):
+            tb.Step(1)
+            values.append((tb.io.out.GetValue(), tb.io.done.GetValue()))
+        return values
+
+    StartGcd(tb, 1071, 462)
+    cycle = tb.Cycle()
+    snapshot = tb.Snapshot()
+    expected = Trace(20)
+
+    tb.Restore(snapshot)
+    assert tb.Cycle() == cycle
+    assert Trace(20) == expected
+
+    tb.Restore(bytes(snapshot))
+    assert Trace(20) == expected
+
+    with tempfile.TemporaryDirectory() as dirname:
+        filename = os.path.join(dirname, 'gcd.ckpt')
+        tb.Restore(snapshot)
+        tb.Save(filename)
+        Trace(5)
+        tb.Restore(filename)
+        assert tb.Cycle() == cycle
+        assert Trace(20) == expected
+
+def CheckCapture(tb):
+    StartGcd(tb, 1071, 462)
+    start_cycle = tb.Cycle()
+    capture = tb.Capture([tb.io.out, tb.io.done], depth=64)
+    values = []
+
+    for _ in range(30):
+        tb.Step(1)
+        values.append([tb.io.out.GetValue(), tb.io.done.GetValue()])
+
+    tb.StopCapture()
+    tb.Step(5)
+
+    assert capture.Count() == 30
+    assert capture.Values().tolist() == values
+    assert capture[tb.io.done].tolist() == [done for (_, done) in values]
+    assert capture.Cycles().tolist() == \
+        list(range(start_cycle + 1, start_cycle + 31))
+
+def CheckTrace(tb):
+    with tempfile.TemporaryDirectory() as dirname:
+        filename = os.path.join(dirname, 'gcd.vcd')
+        StartGcd(tb, 1071, 462)
+
+        tb.OpenTrace(filename)
+        tb.TraceWindow(tb.Cycle() + 2, tb.Cycle() + 4)
+        tb.Step(10)
+        tb.CloseTrace()
+        tb.TraceWindow()
+
+        #
+        # Every traced cycle dumps twice (clock low and high), so all 10 cycles
+        # would give 20 timestamps.
+        #
+
+        with open(filename) as f:
+            times = [line for line in f if line.startswith('#')]
+
+        assert 0 < len(times) <= 4, times
+
+def CheckMonitors(tb):
+    tb.Reset(10)
+    tb.ClearMonitors()
+    tb.io.in_a <<= 0xdead
+    tb.io.in_b <<= 2
+    tb.io.start <<= 1
+
+    try:
+        tb.Step(5)
+        fired = False
+    except AssertionError:
+        fired = True
+
+    results = tb.Monitors()
+
+    assert fired, 'no_magic should have stopped the simulation'
+    assert results['no_magic'].count == 1
+    assert results['no_magic'].first_cycle == tb.Cycle()
+    assert results['starts'].count == 1
+
+    tb.io.start <<= 0
+    tb.ClearMonitors()
+
+monitors = [
+    MonAssert(
+        'no_magic',
+        MonImplies(MonIo('io_start') == 1, MonIo('io_in_a') != 0xdead)),
+    MonCounter('starts', MonIo('io_start') == 1),
+]
+
+with TestModule(lambda: Gcd(64), monitors=monitors) as tb:
+    CheckGroup(tb)
+    CheckRun(tb)
+    CheckReplay(tb)
+    CheckCapture(tb)
+    CheckTrace(tb)
+    CheckMonitors(tb)
+
+    cases = [(i, j) for i in range(2, 100) for j in range(2, 100)]
+    stats = RunSharded(tb.circuit, tb.so_name, GcdCase, cases)
+
+    for (case, h) in zip(cases, stats.results):
+        if h is not None and h >= 10:
+            print(h, '==', SwGcd(*case))
+
+    print(stats)
+    assert stats.failed == 0, stats.failures[0][2]